@@ -0,0 +1,108 @@
+import os
+import queue
+import threading
+import multiprocessing
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Colunas de cada vaga: fotos concluídas e unidades de progresso (inclui etapas intermediárias)
+COLUNA_PROCESSADAS = 0
+COLUNA_PROGRESSO = 1
+NUM_COLUNAS = 2
+
+
+class ContadoresCompartilhados:
+    """Contadores de progresso em memória compartilhada, sem passar pelo processo do Manager.
+
+    Cada processo (e cada thread do processo principal) escreve só na própria vaga de um
+    bloco de inteiros, então os incrementos não precisam de trava nem de comunicação entre
+    processos; quem lê soma as vagas. Só a reserva de uma vaga nova usa a trava do alocador.
+    """
+
+    def __init__(self, num_vagas: int = 256):
+        self.num_vagas = num_vagas
+        self.valores = multiprocessing.Array('q', num_vagas * NUM_COLUNAS, lock=False)
+        self.proxima_vaga = multiprocessing.Value('i', 0)  # Também serve de trava para a reserva
+        self.geracao = multiprocessing.Value('i', 0, lock=False)  # Muda a cada zerar(), invalidando as vagas reservadas
+        self._local = threading.local()
+
+    def __getstate__(self) -> dict:
+        estado = self.__dict__.copy()
+        del estado['_local']
+        return estado
+
+    def __setstate__(self, estado: dict) -> None:
+        self.__dict__.update(estado)
+        self._local = threading.local()
+
+    def _vaga(self) -> int:
+        # A vaga guardada vale para este processo e esta geração; após um fork o filho reserva a sua
+        chave = (os.getpid(), self.geracao.value)
+        if getattr(self._local, 'chave', None) != chave:
+            with self.proxima_vaga.get_lock():
+                vaga = self.proxima_vaga.value
+                self.proxima_vaga.value += 1
+            if vaga >= self.num_vagas:
+                # Sem vagas livres: divide uma já usada, com risco de perder incrementos simultâneos
+                logger.warning(f"Contadores compartilhados sem vagas livres ({self.num_vagas}); reutilizando a vaga {vaga % self.num_vagas}")
+                vaga %= self.num_vagas
+            self._local.chave = chave
+            self._local.vaga = vaga
+        return self._local.vaga
+
+    def contar_processadas(self, quantidade: int = 1) -> None:
+        """Conta fotos concluídas, que também avançam o progresso."""
+        base = self._vaga() * NUM_COLUNAS
+        self.valores[base + COLUNA_PROCESSADAS] += quantidade
+        self.valores[base + COLUNA_PROGRESSO] += quantidade
+
+    def avancar_progresso(self, quantidade: int = 1) -> None:
+        """Avança só o progresso, para etapas que não concluem a foto (pré-processamento)."""
+        self.valores[self._vaga() * NUM_COLUNAS + COLUNA_PROGRESSO] += quantidade
+
+    def somar(self, coluna: int) -> int:
+        return sum(self.valores[coluna::NUM_COLUNAS])
+
+    def zerar(self) -> None:
+        """Zera os contadores no início de uma execução; só deve ser chamado sem workers ativos."""
+        with self.proxima_vaga.get_lock():
+            for i in range(len(self.valores)):
+                self.valores[i] = 0
+            self.proxima_vaga.value = 0
+            self.geracao.value += 1
+
+
+class ContadorProcessadas:
+    """Visão somente leitura do total de fotos concluídas, com a mesma interface `.value` de um Value."""
+
+    def __init__(self, contadores: ContadoresCompartilhados):
+        self.contadores = contadores
+
+    @property
+    def value(self) -> int:
+        return self.contadores.somar(COLUNA_PROCESSADAS)
+
+
+class FilaProgresso:
+    """Visão do progresso como fila: cada leitura devolve, em um único evento, o avanço desde a anterior.
+
+    Mantém a interface `get_nowait()` que a interface gráfica já consome, levantando
+    `queue.Empty` quando nada avançou.
+    """
+
+    def __init__(self, contadores: ContadoresCompartilhados):
+        self.contadores = contadores
+        self.lido = 0
+        self.geracao = contadores.geracao.value
+
+    def get_nowait(self) -> int:
+        if self.geracao != self.contadores.geracao.value:
+            self.geracao = self.contadores.geracao.value
+            self.lido = 0
+        atual = self.contadores.somar(COLUNA_PROGRESSO)
+        if atual <= self.lido:
+            raise queue.Empty
+        avanco = atual - self.lido
+        self.lido = atual
+        return avanco
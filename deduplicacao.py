@@ -0,0 +1,98 @@
+import logging
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Como um membro se liga ao representante do grupo
+DUPLICATA_EXATA = "exata"
+DUPLICATA_SEMELHANTE = "semelhante"
+
+
+class AgrupadorDuplicatas:
+    """Agrupa as fotos de entrada à medida que são encontradas, para reconhecer cada grupo uma única vez.
+
+    Duplicatas exatas têm o mesmo hash de conteúdo; o hash só é calculado quando duas fotos
+    têm o mesmo tamanho. Quase idênticas são as que têm hash perceptual (dHash de 64 bits) a
+    no máximo `distancia_maxima` bits de distância e foram tiradas com no máximo
+    `janela_rajada` segundos de intervalo: só o hash confunde retratos diferentes feitos com o
+    mesmo enquadramento. A busca divide o hash em faixas, já que dois hashes próximos o
+    bastante coincidem por inteiro em pelo menos uma delas. Hash perceptual e horário chegam
+    prontos em `agrupar`, para que quem chama possa calculá-los em paralelo.
+    """
+
+    def __init__(self, calcular_hash: Callable[[Path], str], distancia_maxima: int, janela_rajada: float):
+        self.calcular_hash = calcular_hash
+        self.distancia_maxima = distancia_maxima
+        self.janela_rajada = janela_rajada
+        self.num_faixas = distancia_maxima + 1
+        self.bits_faixa = -(-64 // self.num_faixas)
+        self.hashes: Dict[str, str] = {}  # Hash de conteúdo já calculado, por caminho
+        self.representantes_por_tamanho: Dict[int, List[str]] = {}
+        self.representante_por_hash: Dict[str, str] = {}
+        self.faixas: List[Dict[int, List[Tuple[int, float, str]]]] = [{} for _ in range(self.num_faixas)]
+        self.membros: Dict[str, List[dict]] = {}  # Representante -> fotos que reaproveitam o resultado dele
+
+    def hash_conteudo(self, caminho: Path) -> str:
+        chave = str(caminho)
+        if chave not in self.hashes:
+            self.hashes[chave] = self.calcular_hash(caminho)
+        return self.hashes[chave]
+
+    def _faixas_do_hash(self, perceptual: int) -> List[int]:
+        mascara = (1 << self.bits_faixa) - 1
+        return [(perceptual >> (i * self.bits_faixa)) & mascara for i in range(self.num_faixas)]
+
+    def _buscar_semelhante(self, perceptual: int, captura: float) -> Optional[str]:
+        for faixa, valor in zip(self.faixas, self._faixas_do_hash(perceptual)):
+            for outro, captura_outro, representante in faixa.get(valor, []):
+                if abs(captura - captura_outro) <= self.janela_rajada and bin(perceptual ^ outro).count("1") <= self.distancia_maxima:
+                    return representante
+        return None
+
+    def agrupar(self, caminho: Path, tamanho: int, mtime: int, nome_saida: Optional[str] = None, perceptual: Optional[int] = None, captura: Optional[float] = None) -> Optional[str]:
+        """Retorna o representante do grupo da foto, ou None se ela é a primeira do seu grupo.
+
+        Sem `perceptual` ou sem `captura` a foto só é comparada com as demais pelo conteúdo exato.
+        """
+        chave = str(caminho)
+        mesmos_tamanho = self.representantes_por_tamanho.setdefault(tamanho, [])
+        if mesmos_tamanho:
+            # Só agora vale a pena ler o conteúdo: há outra foto com exatamente o mesmo tamanho
+            for representante in mesmos_tamanho:
+                self.representante_por_hash.setdefault(self.hash_conteudo(Path(representante)), representante)
+            hash_conteudo = self.hash_conteudo(caminho)
+            representante = self.representante_por_hash.get(hash_conteudo)
+            if representante is not None:
+                self._adicionar(representante, chave, nome_saida, tamanho, mtime, hash_conteudo, DUPLICATA_EXATA)
+                return representante
+        if perceptual is not None and captura is not None:
+            representante = self._buscar_semelhante(perceptual, captura)
+            if representante is not None:
+                self._adicionar(representante, chave, nome_saida, tamanho, mtime, self.hashes.get(chave), DUPLICATA_SEMELHANTE)
+                return representante
+            for faixa, valor in zip(self.faixas, self._faixas_do_hash(perceptual)):
+                faixa.setdefault(valor, []).append((perceptual, captura, chave))
+        mesmos_tamanho.append(chave)
+        if chave in self.hashes:
+            self.representante_por_hash.setdefault(self.hashes[chave], chave)
+        return None
+
+    def _adicionar(self, representante: str, caminho: str, nome_saida: Optional[str], tamanho: int, mtime: int, hash_conteudo: Optional[str], tipo: str) -> None:
+        self.membros.setdefault(representante, []).append({
+            'caminho': caminho,
+            'nome_saida': nome_saida or Path(caminho).name,
+            'tamanho': tamanho,
+            'mtime': mtime,
+            'hash': hash_conteudo,
+            'tipo': tipo,
+        })
+        logger.info(f"{Path(caminho).name}: duplicata {tipo} de {Path(representante).name}, será reconhecida uma única vez")
+
+    def contar(self) -> Dict[str, int]:
+        """Quantidade de membros por tipo de duplicata."""
+        contagem = {DUPLICATA_EXATA: 0, DUPLICATA_SEMELHANTE: 0}
+        for membros in self.membros.values():
+            for membro in membros:
+                contagem[membro['tipo']] += 1
+        return contagem
@@ -0,0 +1,117 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def assinatura_matriz(matriz: np.ndarray) -> str:
+    """Identifica o conteúdo de uma matriz de codificações."""
+    resumo = hashlib.blake2b(digest_size=16)
+    resumo.update(str(matriz.shape).encode())
+    resumo.update(np.ascontiguousarray(matriz, dtype=np.float32).tobytes())
+    return resumo.hexdigest()
+
+
+class IndiceIVF:
+    """Índice aproximado por listas invertidas (IVF) sobre codificações normalizadas, só com numpy.
+
+    Um k-means esférico divide a galeria em listas; cada consulta visita apenas as listas
+    cujos centroides são mais próximos e calcula a similaridade exata dos candidatos, de onde
+    saem os k melhores.
+    """
+
+    def __init__(self, centroides: np.ndarray, ordem: np.ndarray, inicios: np.ndarray, assinatura: str):
+        self.centroides = centroides
+        self.ordem = ordem  # Linhas da galeria agrupadas por lista
+        self.inicios = inicios  # Lista i = ordem[inicios[i]:inicios[i + 1]]
+        self.assinatura = assinatura
+
+    @property
+    def num_listas(self) -> int:
+        return len(self.centroides)
+
+    @classmethod
+    def construir(cls, matriz: np.ndarray, num_listas: Optional[int] = None, iteracoes: int = 10, semente: int = 0) -> 'IndiceIVF':
+        """Treina os centroides com k-means esférico e distribui as linhas da matriz (já normalizada) nas listas."""
+        total = len(matriz)
+        if num_listas is None:
+            num_listas = int(4 * np.sqrt(total))
+        num_listas = max(1, min(num_listas, total))
+        gerador = np.random.default_rng(semente)
+        # Treina em uma amostra para limitar o custo; a atribuição final usa a galeria inteira
+        amostra = matriz[gerador.choice(total, size=min(total, 64 * num_listas), replace=False)]
+        centroides = np.array(amostra[gerador.choice(len(amostra), size=num_listas, replace=False)], dtype=np.float32)
+        for _ in range(iteracoes):
+            atribuicao = cls._atribuir(amostra, centroides)
+            somas = np.zeros_like(centroides)
+            np.add.at(somas, atribuicao, amostra)
+            contagem = np.bincount(atribuicao, minlength=num_listas)
+            vazias = contagem == 0
+            if vazias.any():
+                somas[vazias] = amostra[gerador.choice(len(amostra), size=int(vazias.sum()))]
+            normas = np.linalg.norm(somas, axis=1, keepdims=True)
+            normas[normas == 0] = 1
+            centroides = (somas / normas).astype(np.float32)
+        atribuicao = cls._atribuir(matriz, centroides)
+        ordem = np.argsort(atribuicao, kind='stable').astype(np.int64)
+        inicios = np.concatenate(([0], np.cumsum(np.bincount(atribuicao, minlength=num_listas)))).astype(np.int64)
+        return cls(centroides, ordem, inicios, assinatura_matriz(matriz))
+
+    @staticmethod
+    def _atribuir(matriz: np.ndarray, centroides: np.ndarray, bloco: int = 8192) -> np.ndarray:
+        """Centroide mais similar de cada linha, calculado em blocos para limitar a memória."""
+        return np.concatenate([
+            np.argmax(matriz[i:i + bloco] @ centroides.T, axis=1) for i in range(0, len(matriz), bloco)
+        ]) if len(matriz) else np.zeros(0, dtype=np.int64)
+
+    def buscar(self, matriz: np.ndarray, consultas: np.ndarray, sondas: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Retorna (linhas, similaridades), ambas (consultas × k), ordenadas da mais para a menos similar.
+
+        Posições sem candidato suficiente ficam com linha -1 e similaridade -inf.
+        """
+        sondas = max(1, min(sondas, self.num_listas))
+        linhas = np.full((len(consultas), k), -1, dtype=np.int64)
+        similaridades = np.full((len(consultas), k), -np.inf, dtype=np.float32)
+        proximas = np.argpartition(-(consultas @ self.centroides.T), sondas - 1, axis=1)[:, :sondas]
+        for i, consulta in enumerate(consultas):
+            candidatos = np.concatenate([self.ordem[self.inicios[lista]:self.inicios[lista + 1]] for lista in proximas[i]])
+            if len(candidatos) == 0:
+                continue
+            # Similaridade exata de todos os candidatos, com os vetores completos
+            pontuacoes = matriz[candidatos] @ consulta
+            quantidade = min(k, len(candidatos))
+            melhores = np.argpartition(-pontuacoes, quantidade - 1)[:quantidade]
+            melhores = melhores[np.argsort(-pontuacoes[melhores])]
+            linhas[i, :quantidade] = candidatos[melhores]
+            similaridades[i, :quantidade] = pontuacoes[melhores]
+        return linhas, similaridades
+
+    def salvar(self, arquivo: Path) -> None:
+        arquivo_temp = arquivo.with_name(arquivo.name + '.tmp')
+        try:
+            with arquivo_temp.open('wb') as f:
+                np.savez(f, centroides=self.centroides, ordem=self.ordem, inicios=self.inicios, assinatura=np.array(self.assinatura))
+            os.replace(arquivo_temp, arquivo)
+            logger.info(f"Índice ANN salvo em {arquivo} ({self.num_listas} listas)")
+        except (PermissionError, OSError) as e:
+            logger.error(f"Erro ao salvar índice ANN {arquivo}: {e}")
+            arquivo_temp.unlink(missing_ok=True)
+
+    @classmethod
+    def carregar(cls, arquivo: Path, assinatura: str) -> Optional['IndiceIVF']:
+        """Carrega o índice salvo se ele foi construído sobre a mesma galeria."""
+        if not arquivo.exists():
+            return None
+        try:
+            with np.load(arquivo, allow_pickle=False) as dados:
+                if str(dados['assinatura']) != assinatura:
+                    return None
+                return cls(dados['centroides'], dados['ordem'], dados['inicios'], assinatura)
+        except (KeyError, ValueError, OSError) as e:
+            logger.warning(f"Índice ANN inválido em {arquivo}, será reconstruído: {e}")
+            return None
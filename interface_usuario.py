@@ -3,6 +3,7 @@ os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from separador_fotos import SeparadorFotos
+from transporte_logs import linhas_do_item
 import threading
 import queue
 import os
@@ -15,6 +16,9 @@ from deepface import DeepFace
 logger = logging.getLogger(__name__)
 
 class InterfaceSeparadorFotos:
+    MAXIMO_LINHAS_LOG = 1000  # Linhas mantidas na área de logs
+    MAXIMO_LOTES_POR_CICLO = 200  # Itens da fila de logs lidos a cada atualização
+
     def __init__(self, janela: tk.Tk):
         """Inicializa a interface gráfica do separador de fotos."""
         self.janela = janela
@@ -41,6 +45,7 @@ class InterfaceSeparadorFotos:
         self.pasta_saida = tk.StringVar(value="")
         self.progresso = tk.DoubleVar(value=0)
         self.total_imagens = 0
+        self.fotos_no_progresso = 0
         self.ultima_foto_logada = 0  # Rastrear última foto exibida no log
 
         # Configuração da interface
@@ -68,6 +73,7 @@ class InterfaceSeparadorFotos:
         frame_botoes.grid_columnconfigure(0, weight=1)
         frame_botoes.grid_columnconfigure(1, weight=1)
         frame_botoes.grid_columnconfigure(2, weight=1)
+        frame_botoes.grid_columnconfigure(3, weight=1)
 
         self.botao_iniciar = tk.Button(frame_botoes, text="Iniciar", command=self.iniciar_separacao)
         self.botao_iniciar.grid(row=0, column=0, padx=5)
@@ -78,6 +84,9 @@ class InterfaceSeparadorFotos:
         self.botao_cancelar = tk.Button(frame_botoes, text="Cancelar", command=self.cancelar_separacao, state=tk.DISABLED)
         self.botao_cancelar.grid(row=0, column=2, padx=5)
 
+        self.botao_reclassificar = tk.Button(frame_botoes, text="Reclassificar", command=self.iniciar_reclassificacao)
+        self.botao_reclassificar.grid(row=0, column=3, padx=5)
+
         self.label_status = tk.Label(janela, text="Pronto")
         self.label_status.grid(row=6, column=0, columnspan=3, pady=5, sticky="ew")
 
@@ -135,7 +144,11 @@ class InterfaceSeparadorFotos:
         except Exception as e:
             logger.error(f"Erro ao salvar configurações: {e}")
 
-    def iniciar_separacao(self) -> None:
+    def iniciar_reclassificacao(self) -> None:
+        """Refaz apenas a comparação com a galeria atual, reaproveitando os rostos já detectados."""
+        self.iniciar_separacao(somente_reclassificar=True)
+
+    def iniciar_separacao(self, somente_reclassificar: bool = False) -> None:
         """Inicia o processo de separação de fotos após validar as pastas."""
         for pasta, nome in [
             (self.pasta_referencia.get(), "referência"),
@@ -156,13 +169,15 @@ class InterfaceSeparadorFotos:
                 return
 
         self.botao_iniciar.config(state=tk.DISABLED)
+        self.botao_reclassificar.config(state=tk.DISABLED)
         self.botao_pausar.config(state=tk.NORMAL)
         self.botao_cancelar.config(state=tk.NORMAL)
         self.progresso.set(0)
         self.ultima_foto_logada = 0  # Resetar log
         self.label_status.config(text="Processando...")
-        from utilitarios_arquivos import listar_imagens
-        self.total_imagens = len(listar_imagens(Path(self.pasta_entrada.get())))
+        # O total vem do separador, que conta as imagens enquanto percorre a pasta
+        self.total_imagens = 0
+        self.fotos_no_progresso = 0
 
         self.thread = threading.Thread(
             target=self.executar_separacao,
@@ -170,15 +185,19 @@ class InterfaceSeparadorFotos:
                 self.pasta_referencia.get(),
                 self.pasta_entrada.get(),
                 self.pasta_saida.get(),
+                somente_reclassificar,
             ),
         )
         self.thread.daemon = True
         self.thread.start()
 
-    def executar_separacao(self, pasta_referencia: str, pasta_entrada: str, pasta_saida: str) -> None:
+    def executar_separacao(self, pasta_referencia: str, pasta_entrada: str, pasta_saida: str, somente_reclassificar: bool = False) -> None:
         """Executa a separação de fotos em uma thread separada."""
         try:
-            self.separador.separar_fotos(pasta_referencia, pasta_entrada, pasta_saida)
+            if somente_reclassificar:
+                self.separador.reclassificar_fotos(pasta_referencia, pasta_entrada, pasta_saida)
+            else:
+                self.separador.separar_fotos(pasta_referencia, pasta_entrada, pasta_saida)
         except (PermissionError, OSError) as e:
             self.fila_logs.put(f"Erro: Sem permissão para acessar uma das pastas: {e}")
             self.janela.after(0, lambda: messagebox.showerror("Erro", str(e)))
@@ -209,57 +228,55 @@ class InterfaceSeparadorFotos:
     def finalizar_separacao(self) -> None:
         """Finaliza o processo de separação, redefinindo a interface."""
         self.botao_iniciar.config(state=tk.NORMAL)
+        self.botao_reclassificar.config(state=tk.NORMAL)
         self.botao_pausar.config(state=tk.DISABLED, text="Pausar")
         self.botao_cancelar.config(state=tk.DISABLED)
         self.progresso.set(0)
         self.label_status.config(text="Concluído")
         self.salvar_configuracoes()
 
+    def inserir_logs(self, linhas: list) -> None:
+        """Insere as linhas na área de logs de uma só vez, mantendo no máximo MAXIMO_LINHAS_LOG."""
+        if not linhas:
+            return
+        linhas = linhas[-self.MAXIMO_LINHAS_LOG:]
+        self.texto_logs.config(state=tk.NORMAL)
+        self.texto_logs.insert(tk.END, "\n".join(linhas) + "\n")
+        # Limitar o número de linhas para evitar sobrecarga
+        total_linhas = int(self.texto_logs.index('end-1c').split('.')[0])
+        if total_linhas > self.MAXIMO_LINHAS_LOG:
+            self.texto_logs.delete(1.0, f"{total_linhas - self.MAXIMO_LINHAS_LOG}.0")
+        self.texto_logs.see(tk.END)
+        self.texto_logs.config(state=tk.DISABLED)
+
     def atualizar_logs(self) -> None:
-        """Atualiza a área de logs com mensagens da fila."""
+        """Atualiza a área de logs com os lotes que chegaram desde a última atualização."""
+        linhas = []
         try:
-            while True:
-                mensagem = self.fila_logs.get_nowait()
-                # Trata objetos LogRecord do QueueHandler
-                if isinstance(mensagem, logging.LogRecord):
-                    texto = mensagem.getMessage()
-                else:
-                    texto = str(mensagem)
-                self.texto_logs.config(state=tk.NORMAL)
-                self.texto_logs.insert(tk.END, texto + "\n")
-                self.texto_logs.see(tk.END)
-                # Limitar o número de linhas para evitar sobrecarga
-                linhas = int(self.texto_logs.index('end-1c').split('.')[0])
-                if linhas > 1000:
-                    self.texto_logs.delete(1.0, f"{linhas-1000}.0")
-                self.texto_logs.config(state=tk.DISABLED)
-                self.janela.update_idletasks()
+            # Limita os lotes lidos por ciclo para a janela continuar respondendo sob carga
+            for _ in range(self.MAXIMO_LOTES_POR_CICLO):
+                linhas.extend(linhas_do_item(self.fila_logs.get_nowait()))
         except queue.Empty:
             pass
+        self.inserir_logs(linhas)
         self.janela.after(100, self.atualizar_logs)
 
     def atualizar_progresso(self) -> None:
         """Atualiza a barra de progresso e os logs de fotos processadas."""
+        self.total_imagens = self.separador.obter_total_imagens()
         try:
             while True:
-                self.fila_progresso.get_nowait()
-                if self.total_imagens > 0:
-                    self.progresso.set((self.progresso.get() + (1 / self.total_imagens) * 100))
+                self.fotos_no_progresso += self.fila_progresso.get_nowait()
         except queue.Empty:
             pass
-        # Atualizar logs com base no contador_processadas
+        # O total ainda pode crescer durante a descoberta, então a porcentagem é recalculada a cada vez
+        if self.total_imagens > 0:
+            self.progresso.set(min(100, self.fotos_no_progresso / self.total_imagens * 100))
+        # Uma linha por ciclo com a contagem atual, em vez de uma por foto
         fotos_processadas = self.contador_processadas.value
-        while self.ultima_foto_logada < fotos_processadas and self.total_imagens > 0:
-            self.ultima_foto_logada += 1
-            self.texto_logs.config(state=tk.NORMAL)
-            self.texto_logs.insert(tk.END, f"Fotos processadas: {self.ultima_foto_logada}/{self.total_imagens} fotos\n")
-            self.texto_logs.see(tk.END)
-            # Limitar o número de linhas
-            linhas = int(self.texto_logs.index('end-1c').split('.')[0])
-            if linhas > 1000:
-                self.texto_logs.delete(1.0, f"{linhas-1000}.0")
-            self.texto_logs.config(state=tk.DISABLED)
-            self.janela.update_idletasks()
+        if self.ultima_foto_logada < fotos_processadas and self.total_imagens > 0:
+            self.ultima_foto_logada = fotos_processadas
+            self.inserir_logs([f"Fotos processadas: {fotos_processadas}/{self.total_imagens} fotos"])
         self.janela.after(100, self.atualizar_progresso)
 
     def ao_fechar(self) -> None:
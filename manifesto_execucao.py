@@ -0,0 +1,218 @@
+import json
+import sqlite3
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Situações registradas para cada foto de entrada
+STATUS_IDENTIFICADA = "identificada"
+STATUS_DESCONHECIDA = "desconhecida"
+STATUS_SEM_ROSTOS = "sem_rostos"
+STATUS_ERRO = "erro"
+
+
+class ManifestoExecucao:
+    """Registro em SQLite, dentro da pasta de saída, do que já foi processado em cada foto de entrada.
+
+    Permite que novas execuções sobre a mesma pasta ignorem as fotos inalteradas e
+    retomem de onde uma execução interrompida parou. As codificações e áreas dos rostos
+    de cada foto ficam guardadas pelo hash do conteúdo, de modo que uma nova galeria ou
+    tolerância só exige refazer a comparação, não a detecção.
+    """
+
+    INTERVALO_CONFIRMACAO = 50  # Registros gravados por transação
+
+    def __init__(self, arquivo: Path, identificador_modelo: str):
+        self.arquivo = arquivo
+        self.identificador_modelo = identificador_modelo
+        self.conexao = sqlite3.connect(str(arquivo))
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.execute("PRAGMA synchronous=NORMAL")
+        self.conexao.executescript(
+            """CREATE TABLE IF NOT EXISTS fotos (
+                caminho TEXT PRIMARY KEY,
+                tamanho INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                hash TEXT,
+                status TEXT NOT NULL,
+                num_rostos INTEGER NOT NULL DEFAULT 0,
+                pessoas TEXT NOT NULL DEFAULT '[]',
+                assinatura_galeria TEXT NOT NULL,
+                processada_em TEXT NOT NULL,
+                nome_saida TEXT
+            );
+            CREATE TABLE IF NOT EXISTS codificacoes (
+                hash TEXT PRIMARY KEY,
+                modelo TEXT NOT NULL,
+                num_rostos INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rostos (
+                hash TEXT NOT NULL,
+                indice INTEGER NOT NULL,
+                x REAL, y REAL, largura REAL, altura REAL,
+                vetor BLOB NOT NULL,
+                PRIMARY KEY (hash, indice)
+            );"""
+        )
+        colunas = {coluna[1] for coluna in self.conexao.execute("PRAGMA table_info(fotos)")}
+        if 'nome_saida' not in colunas:
+            # Manifestos anteriores não guardavam o nome de saída: vale o nome do arquivo
+            self.conexao.execute("ALTER TABLE fotos ADD COLUMN nome_saida TEXT")
+        self.conexao.commit()
+        self.pendentes = 0
+
+    def __enter__(self) -> 'ManifestoExecucao':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.fechar()
+
+    def carregar_estado(self) -> Dict[str, dict]:
+        """Retorna {caminho: registro} de todas as fotos registradas."""
+        cursor = self.conexao.execute("SELECT caminho, tamanho, mtime, hash, status, num_rostos, pessoas, assinatura_galeria, nome_saida FROM fotos")
+        return {
+            caminho: {
+                'tamanho': tamanho,
+                'mtime': mtime,
+                'hash': hash_conteudo,
+                'status': status,
+                'num_rostos': num_rostos,
+                'pessoas': json.loads(pessoas),
+                'assinatura_galeria': assinatura,
+                'nome_saida': nome_saida or Path(caminho).name,
+            }
+            for caminho, tamanho, mtime, hash_conteudo, status, num_rostos, pessoas, assinatura, nome_saida in cursor
+        }
+
+    @staticmethod
+    def arquivo_inalterado(estado: Optional[dict], caminho: Path) -> bool:
+        """Indica se a foto foi processada com sucesso e o arquivo não mudou desde então."""
+        if estado is None or estado['status'] == STATUS_ERRO:
+            return False
+        try:
+            atual = caminho.stat()
+        except OSError:
+            return False
+        return atual.st_size == estado['tamanho'] and atual.st_mtime_ns == estado['mtime']
+
+    def registrar(self, resultado: dict, assinatura_galeria: str) -> None:
+        """Grava o resultado de uma foto e, se presentes, suas codificações; as transações são confirmadas em blocos."""
+        self.conexao.execute(
+            "INSERT OR REPLACE INTO fotos (caminho, tamanho, mtime, hash, status, num_rostos, pessoas, "
+            "assinatura_galeria, processada_em, nome_saida) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                resultado['caminho'],
+                resultado['tamanho'],
+                resultado['mtime'],
+                resultado.get('hash'),
+                resultado['status'],
+                resultado.get('num_rostos', 0),
+                json.dumps(sorted(resultado.get('pessoas', []))),
+                assinatura_galeria,
+                datetime.now().isoformat(timespec='seconds'),
+                resultado.get('nome_saida') or Path(resultado['caminho']).name,
+            ),
+        )
+        if resultado.get('hash') and 'codificacoes' in resultado:
+            self.gravar_codificacoes(resultado['hash'], resultado['codificacoes'], resultado.get('areas', []))
+        self.pendentes += 1
+        if self.pendentes >= self.INTERVALO_CONFIRMACAO:
+            self.confirmar()
+
+    def listar_classificacoes(self) -> Iterator[Tuple[str, str, List[str]]]:
+        """Percorre (caminho, status, pessoas) de todas as fotos registradas."""
+        cursor = self.conexao.execute("SELECT caminho, status, pessoas FROM fotos ORDER BY caminho")
+        for caminho, status, pessoas in cursor:
+            yield caminho, status, json.loads(pessoas)
+
+    def gravar_codificacoes(self, hash_conteudo: str, codificacoes: np.ndarray, areas: List[Tuple[float, float, float, float]]) -> None:
+        """Substitui as codificações guardadas para o conteúdo indicado."""
+        self.conexao.execute("DELETE FROM rostos WHERE hash = ?", (hash_conteudo,))
+        self.conexao.execute(
+            "INSERT OR REPLACE INTO codificacoes VALUES (?, ?, ?)",
+            (hash_conteudo, self.identificador_modelo, len(codificacoes)),
+        )
+        self.conexao.executemany(
+            "INSERT INTO rostos VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (hash_conteudo, i, *(areas[i] if i < len(areas) else (None, None, None, None)),
+                 np.asarray(vetor, dtype=np.float32).tobytes())
+                for i, vetor in enumerate(codificacoes)
+            ],
+        )
+
+    def copiar_codificacoes(self, hash_origem: str, hash_destino: str) -> bool:
+        """Guarda para outro conteúdo as codificações e áreas de um conteúdo já codificado; retorna False se não houver."""
+        if hash_origem == hash_destino:
+            return True
+        linha = self.conexao.execute(
+            "SELECT num_rostos FROM codificacoes WHERE hash = ? AND modelo = ?", (hash_origem, self.identificador_modelo)
+        ).fetchone()
+        if linha is None:
+            return False
+        self.conexao.execute("DELETE FROM rostos WHERE hash = ?", (hash_destino,))
+        self.conexao.execute(
+            "INSERT OR REPLACE INTO codificacoes VALUES (?, ?, ?)",
+            (hash_destino, self.identificador_modelo, linha[0]),
+        )
+        self.conexao.execute(
+            "INSERT INTO rostos SELECT ?, indice, x, y, largura, altura, vetor FROM rostos WHERE hash = ?",
+            (hash_destino, hash_origem),
+        )
+        return True
+
+    def hashes_codificados(self) -> set:
+        """Hashes de conteúdo com codificações guardadas para o modelo atual."""
+        cursor = self.conexao.execute("SELECT hash FROM codificacoes WHERE modelo = ?", (self.identificador_modelo,))
+        return {hash_conteudo for hash_conteudo, in cursor}
+
+    def carregar_codificacoes(self, hashes: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Retorna {hash: matriz float32 de codificações} para os conteúdos codificados com o modelo atual.
+
+        Conteúdos sem nenhum rosto aparecem com uma matriz vazia; os ausentes do dicionário
+        precisam ser processados novamente.
+        """
+        # Os hashes pedidos vão para uma tabela temporária, para que só as linhas deles sejam lidas
+        self.conexao.execute("CREATE TEMP TABLE IF NOT EXISTS hashes_pedidos (hash TEXT PRIMARY KEY)")
+        self.conexao.execute("DELETE FROM hashes_pedidos")
+        self.conexao.executemany(
+            "INSERT OR IGNORE INTO hashes_pedidos VALUES (?)", ((h,) for h in hashes if h)
+        )
+        codificacoes = {}
+        cursor = self.conexao.execute(
+            "SELECT c.hash, c.num_rostos FROM hashes_pedidos p CROSS JOIN codificacoes c ON c.hash = p.hash "
+            "WHERE c.modelo = ?",
+            (self.identificador_modelo,),
+        )
+        quantidades = dict(cursor.fetchall())
+        vetores: Dict[str, List[np.ndarray]] = {h: [] for h in quantidades}
+        cursor = self.conexao.execute(
+            # CROSS JOIN fixa a ordem das tabelas: percorre os pedidos e busca os rostos pela chave
+            "SELECT r.hash, r.vetor FROM hashes_pedidos p CROSS JOIN codificacoes c ON c.hash = p.hash "
+            "CROSS JOIN rostos r ON r.hash = p.hash WHERE c.modelo = ? ORDER BY p.hash, r.indice",
+            (self.identificador_modelo,),
+        )
+        for hash_conteudo, vetor in cursor:
+            vetores[hash_conteudo].append(np.frombuffer(vetor, dtype=np.float32))
+        self.conexao.execute("DELETE FROM hashes_pedidos")
+        for hash_conteudo, lista in vetores.items():
+            if len(lista) != quantidades[hash_conteudo]:
+                continue  # Registro incompleto: a foto será reprocessada
+            codificacoes[hash_conteudo] = np.vstack(lista) if lista else np.zeros((0, 0), dtype=np.float32)
+        return codificacoes
+
+    def confirmar(self) -> None:
+        if self.pendentes:
+            self.conexao.commit()
+            self.pendentes = 0
+
+    def fechar(self) -> None:
+        try:
+            self.confirmar()
+        finally:
+            self.conexao.close()
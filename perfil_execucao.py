@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import threading
+import logging
+from array import array
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ARQUIVO_PERFIL = "perfil_execucao.json"
+PERCENTIS = (50, 95, 99)
+
+
+class TemposFoto:
+    """Segundos gastos em cada etapa com uma foto, e o processo que executou cada etapa.
+
+    Viaja dentro do registro da foto entre os workers e o processo principal, que soma
+    tudo no PerfilExecucao quando a foto é registrada.
+    """
+
+    __slots__ = ('segundos', 'processos')
+
+    def __init__(self):
+        self.segundos: Dict[str, float] = {}
+        self.processos: Dict[str, int] = {}
+
+    def __getstate__(self) -> tuple:
+        return self.segundos, self.processos
+
+    def __setstate__(self, estado: tuple) -> None:
+        self.segundos, self.processos = estado
+
+    def adicionar(self, estagio: str, segundos: float) -> None:
+        self.segundos[estagio] = self.segundos.get(estagio, 0.0) + segundos
+        self.processos[estagio] = os.getpid()
+
+
+@contextmanager
+def medir(tempos: Optional[TemposFoto], estagio: str) -> Iterator[None]:
+    """Soma a duração do bloco à etapa indicada; sem `tempos` (perfil desativado) não mede nada."""
+    if tempos is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tempos.adicionar(estagio, time.perf_counter() - inicio)
+
+
+def repartir_tempo(tempos: List[Optional[TemposFoto]], pesos: List[int], estagio: str, segundos: float) -> None:
+    """Divide o tempo de uma operação em lote entre as fotos, na proporção dos pesos (rostos de cada uma)."""
+    total = sum(pesos)
+    if total == 0:
+        return
+    for tempos_foto, peso in zip(tempos, pesos):
+        if tempos_foto is not None and peso:
+            tempos_foto.adicionar(estagio, segundos * peso / total)
+
+
+class PerfilExecucao:
+    """Acumula, no processo principal, as durações por etapa e por processo de uma execução.
+
+    As amostras ficam em arrays compactos de float; percentis, taxas e totais só são
+    calculados em `resumo()`, ao final.
+    """
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.amostras: Dict[str, array] = {}
+        self.por_processo: Dict[str, Dict[int, List[float]]] = {}  # etapa -> pid -> [amostras, segundos]
+        self.imagens = 0
+        self.rostos = 0
+        self.trava = threading.Lock()  # Descoberta, cópia e registro rodam em threads diferentes
+
+    def registrar(self, estagio: str, segundos: float, pid: Optional[int] = None) -> None:
+        with self.trava:
+            self._registrar(estagio, segundos, pid or os.getpid())
+
+    def _registrar(self, estagio: str, segundos: float, pid: int) -> None:
+        self.amostras.setdefault(estagio, array('d')).append(segundos)
+        acumulado = self.por_processo.setdefault(estagio, {}).setdefault(pid, [0, 0.0])
+        acumulado[0] += 1
+        acumulado[1] += segundos
+
+    @contextmanager
+    def medir(self, estagio: str) -> Iterator[None]:
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar(estagio, time.perf_counter() - inicio)
+
+    def adicionar_foto(self, tempos: Optional[TemposFoto], num_rostos: int) -> None:
+        """Conta uma foto concluída e soma as etapas medidas para ela."""
+        with self.trava:
+            self.imagens += 1
+            self.rostos += num_rostos
+            if tempos is not None:
+                for estagio, segundos in tempos.segundos.items():
+                    self._registrar(estagio, segundos, tempos.processos.get(estagio, 0))
+
+    def resumo(self, extras: Optional[dict] = None) -> dict:
+        duracao = time.perf_counter() - self.inicio
+        with self.trava:
+            estagios = {}
+            for estagio, valores in self.amostras.items():
+                dados = np.frombuffer(valores, dtype=np.float64) * 1000
+                percentis = np.percentile(dados, PERCENTIS) if len(dados) else [0.0] * len(PERCENTIS)
+                estagios[estagio] = {
+                    'amostras': len(dados),
+                    'total_s': round(float(dados.sum()) / 1000, 3),
+                    'media_ms': round(float(dados.mean()), 3) if len(dados) else 0.0,
+                    **{f'p{p}_ms': round(float(v), 3) for p, v in zip(PERCENTIS, percentis)},
+                    'max_ms': round(float(dados.max()), 3) if len(dados) else 0.0,
+                }
+            processos = {
+                estagio: {str(pid): {'amostras': n, 'total_s': round(s, 3)} for pid, (n, s) in sorted(pids.items())}
+                for estagio, pids in self.por_processo.items()
+            }
+            return {
+                'data': datetime.now().isoformat(timespec='seconds'),
+                'duracao_s': round(duracao, 3),
+                'imagens_processadas': self.imagens,
+                'rostos': self.rostos,
+                'imagens_por_segundo': round(self.imagens / duracao, 3) if duracao > 0 else 0.0,
+                'rostos_por_segundo': round(self.rostos / duracao, 3) if duracao > 0 else 0.0,
+                **(extras or {}),
+                'estagios': estagios,
+                'processos': processos,
+            }
+
+    def salvar(self, arquivo: Path, extras: Optional[dict] = None) -> None:
+        try:
+            with arquivo.open('w', encoding='utf-8') as f:
+                json.dump(self.resumo(extras), f, ensure_ascii=False, indent=2)
+            logger.info(f"Perfil da execução gravado em '{arquivo}'")
+        except (PermissionError, OSError) as e:
+            logger.error(f"Erro ao gravar perfil da execução: {e}")
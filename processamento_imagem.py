@@ -1,20 +1,214 @@
+import io
+import math
+import json
+import hashlib
 import cv2
 import numpy as np
 from numpy.linalg import norm
-from PIL import Image
+from PIL import Image, ImageOps
 from pathlib import Path
 import logging
-from typing import Optional, Tuple, List, Union
+import time
+from datetime import datetime
+from typing import Optional, Tuple, List, Union, Dict, Set
 from deepface import DeepFace
 
+from indice_ann import IndiceIVF, assinatura_matriz
+from perfil_execucao import TemposFoto, medir, repartir_tempo
+
 logger = logging.getLogger(__name__)
 
 class Configuracao:
     MODELO: str = "Facenet512"  # Já configurado
-    DETECTOR: str = "dlib"
+    DETECTOR: str = "dlib"  # Detector preciso, usado sozinho ou como último da cascata
+    DETECTORES_RAPIDOS: Tuple[str, ...] = ("opencv",)  # Tentados antes do DETECTOR; vazio desativa a cascata
+    CONFIANCA_MINIMA_RAPIDO: float = 0.5  # Rostos abaixo disso em um detector rápido passam ao próximo
+    DETECCAO_EM_DUAS_RESOLUCOES: bool = True  # Detecta numa cópia reduzida e recorta da imagem em resolução cheia
+    LADO_DETECCAO: int = 640  # Maior lado da cópia usada na detecção
+    TAMANHO_MAXIMO_RECORTE: Tuple[int, int] = (3000, 3000)  # Limite da imagem decodificada no modo de duas resoluções
+    DECODIFICACAO_REDUZIDA: bool = True  # JPEGs grandes são decodificados direto em 1/2, 1/4 ou 1/8 da resolução
+    MINIATURA_EXIF_PRIMEIRO: bool = False  # Detecta antes na miniatura EXIF e só decodifica a foto se houver rosto
+    LADO_MINIMO_MINIATURA: int = 160  # Miniaturas com o maior lado abaixo disso não são usadas para descartar a foto
+    LISTAGEM_RAPIDA: bool = True  # Lista as imagens conferindo só o cabeçalho; arquivos corrompidos falham ao decodificar
+    DESCOBERTA_EM_FLUXO: bool = True  # Reconhece as fotos à medida que a pasta de entrada é percorrida
+    MODO_COLOCACAO: str = "copia"  # "copia", "hardlink", "reflink", "symlink" ou "indice" (só lista as fotos)
+    DEDUPLICAR_FOTOS: bool = True  # Fotos com o mesmo conteúdo são reconhecidas uma única vez
+    DEDUPLICAR_SEMELHANTES: bool = False  # Também agrupa quase idênticas de uma mesma rajada (hash perceptual + horário EXIF)
+    DISTANCIA_MAXIMA_SEMELHANTES: int = 4  # Bits diferentes, em 64, para considerar duas fotos semelhantes
+    JANELA_RAJADA_SEGUNDOS: float = 2.0  # Semelhantes só são agrupadas se tiradas com no máximo este intervalo
+    THREADS_DEDUPLICACAO: int = 4  # Threads que calculam o hash perceptual das fotos à frente do agrupamento
     TOLERANCIA: float = 0.35
-    TAMANHO_MAXIMO: Tuple[int, int] = (1280, 720)
+    TAMANHO_MAXIMO: Tuple[int, int] = (1280, 720)  # Imagem decodificada quando há uma única resolução
+    TAMANHO_CHUNK: int = 1  # Tarefas enviadas por vez a cada processo (chunksize do imap_unordered)
+    TAREFAS_EM_VOO_POR_PROCESSO: int = 3  # Limite de tarefas pendentes por processo
+    PIPELINE_EM_MEMORIA: bool = True  # Entrega a imagem decodificada ao DeepFace sem arquivos temporários
+    USAR_INDICE_ANN: bool = True  # Busca aproximada (IVF) para galerias muito grandes
+    ANN_MINIMO_REFERENCIAS: int = 5000  # Abaixo disso a busca exata já é rápida o bastante
+    ANN_SONDAS: int = 8  # Listas visitadas por consulta: mais sondas, mais recall e menos velocidade
+    INFERENCIA_EM_LOTE: bool = True  # Codifica os recortes de várias fotos por chamada da rede
+    TAMANHO_LOTE_INFERENCIA: int = 32  # Recortes por chamada da rede de reconhecimento
+    FOTOS_POR_TAREFA: int = 16  # Fotos detectadas por tarefa antes de codificar os recortes em lote
+    PIPELINE_EM_ESTAGIOS: bool = True  # Detecção e codificação em grupos de processos separados (requer INFERENCIA_EM_LOTE)
+    PROCESSOS_DETECCAO: int = 0  # 0 = automático (o restante dos núcleos)
+    PROCESSOS_CODIFICACAO: int = 0  # 0 = automático (cerca de um terço dos núcleos)
+    THREADS_COLOCACAO: int = 4  # Threads que copiam as fotos para as pastas de saída
+    TAMANHO_FILA_ESTAGIO: int = 64  # Fotos em espera entre os estágios
+    ESPERA_LOTE_SEGUNDOS: float = 0.05  # Espera máxima para completar um lote de recortes
+    LIMITAR_THREADS: bool = True  # Divide os núcleos entre os processos em vez de cada biblioteca usar todos
+    THREADS_POR_PROCESSO: int = 0  # 0 = automático (núcleos / processos)
+    THREADS_INTER_OP: int = 1  # Operações do TensorFlow executadas em paralelo por processo
+    THREADS_OPENCV: int = 0  # 0 = igual a THREADS_POR_PROCESSO
+    THREADS_BLAS: int = 0  # 0 = igual a THREADS_POR_PROCESSO (numpy/OpenBLAS/MKL)
+    INTERVALO_ENVIO_LOGS: float = 0.25  # Segundos entre os lotes de logs enviados por processo à interface
+    LINHAS_POR_LOTE_LOG: int = 100  # Um lote cheio é enviado antes do intervalo
+    LOGS_INFO_POR_SEGUNDO: int = 50  # Acima disso, por processo, INFO e DEBUG são omitidos na interface
+    PERFIL_EXECUCAO: bool = True  # Mede cada etapa por foto e grava perfil_execucao.json ao lado do relatório
+
+# Modelo de reconhecimento e detector preparados no processo atual
+_modelo_reconhecimento = None
+_detector: Optional['DetectorRostos'] = None
+_detector_pronto = False
+
+
+def quadro_inteiro(resultado: dict, largura: int, altura: int) -> bool:
+    """Indica se o resultado é o quadro inteiro que o DeepFace devolve, com confiança 0, quando não acha rosto."""
+    area = resultado.get("facial_area") or {}
+    confianca = resultado.get("confidence", resultado.get("face_confidence")) or 0
+    return (
+        not confianca
+        and area.get("x", 0) <= 0 and area.get("y", 0) <= 0
+        and area.get("w", largura) >= largura and area.get("h", altura) >= altura
+    )
+
+
+class DetectorRostos:
+    """Cascata de detectores do DeepFace: os rápidos primeiro e o preciso só quando necessário.
+
+    Um detector rápido é aceito quando encontra ao menos um rosto e todos têm confiança
+    mínima; caso contrário a imagem passa ao próximo. O último detector é sempre aceito.
+    O quadro inteiro que o DeepFace devolve quando não há rosto nunca é tratado como rosto.
+    O tempo gasto em cada um fica registrado para avaliar a cascata.
+    """
+
+    INTERVALO_RESUMO = 500  # Imagens entre resumos de tempo no log
+
+    def __init__(self, backends: List[str], confianca_minima: float):
+        self.backends = backends
+        self.confianca_minima = confianca_minima
+        self.zerar_estatisticas()
+
+    def zerar_estatisticas(self) -> None:
+        self.tempos = {backend: 0.0 for backend in self.backends}
+        self.chamadas = {backend: 0 for backend in self.backends}
+        self.aceitas = {backend: 0 for backend in self.backends}
+        self.imagens = 0
+
+    @classmethod
+    def da_configuracao(cls) -> 'DetectorRostos':
+        backends = [b for b in Configuracao.DETECTORES_RAPIDOS if b != Configuracao.DETECTOR] + [Configuracao.DETECTOR]
+        return cls(backends, Configuracao.CONFIANCA_MINIMA_RAPIDO)
+
+    def _executar(self, backend: str, imagem: np.ndarray, alinhar: bool = True) -> List[dict]:
+        inicio = time.perf_counter()
+        try:
+            return DeepFace.extract_faces(
+                img_path=imagem,
+                detector_backend=backend,
+                enforce_detection=False,
+                align=alinhar
+            )
+        finally:
+            self.tempos[backend] += time.perf_counter() - inicio
+            self.chamadas[backend] += 1
+
+    def _aceitavel(self, resultados: List[dict]) -> bool:
+        # Sem rosto o DeepFace devolve a imagem inteira com confiança 0
+        return bool(resultados) and all((r.get("confidence") or 0) >= self.confianca_minima for r in resultados)
+
+    def detectar(self, imagem: np.ndarray, alinhar: bool = True) -> List[dict]:
+        """Retorna os resultados do DeepFace.extract_faces do primeiro detector aceito."""
+        resultados: List[dict] = []
+        for posicao, backend in enumerate(self.backends):
+            ultimo = posicao == len(self.backends) - 1
+            try:
+                resultados = self._executar(backend, imagem, alinhar)
+            except Exception as e:
+                if ultimo:
+                    raise
+                logger.warning(f"Detector {backend} falhou, usando o próximo da cascata: {e}")
+                continue
+            if ultimo or self._aceitavel(resultados):
+                self.aceitas[backend] += 1
+                break
+        self.imagens += 1
+        if self.imagens % self.INTERVALO_RESUMO == 0:
+            logger.info(f"Detecção: {self.resumo()}")
+        # Recortado da imagem cheia, o quadro inteiro ocuparia dezenas de MB só para virar um 160×160 sem rosto
+        altura, largura = imagem.shape[:2]
+        return [r for r in resultados if not quadro_inteiro(r, largura, altura)]
+
+    def resumo(self) -> str:
+        """Chamadas, imagens aceitas e tempo médio de cada detector."""
+        return ", ".join(
+            f"{b}: {self.aceitas[b]}/{self.chamadas[b]} aceitas, {1000 * self.tempos[b] / max(1, self.chamadas[b]):.1f} ms/imagem"
+            for b in self.backends
+        )
+
+
+def identificador_detector() -> str:
+    """Nome da detecção que efetivamente roda, usado para invalidar caches gerados com outra."""
+    if not Configuracao.INFERENCIA_EM_LOTE:
+        # Sem inferência em lote o DeepFace.represent detecta só com o DETECTOR, sem cascata
+        identificador = Configuracao.DETECTOR
+    else:
+        identificador = ">".join(DetectorRostos.da_configuracao().backends)
+        if duas_resolucoes_ativas():
+            identificador += f"@{Configuracao.LADO_DETECCAO}"
+    if Configuracao.MINIATURA_EXIF_PRIMEIRO:
+        # Fotos descartadas pela miniatura nunca chegam ao detector principal
+        identificador += f"+exif{Configuracao.LADO_MINIMO_MINIATURA}"
+    return identificador
+
+def obter_detector() -> DetectorRostos:
+    global _detector
+    if _detector is None:
+        _detector = DetectorRostos.da_configuracao()
+    return _detector
+
+
+def _imagem_aquecimento() -> np.ndarray:
+    return np.zeros((Configuracao.TAMANHO_MAXIMO[1] // 4, Configuracao.TAMANHO_MAXIMO[0] // 4, 3), dtype=np.uint8)
 
+def preparar_detector() -> None:
+    """Constrói os detectores da cascata no processo atual com uma detecção de aquecimento em cada um."""
+    global _detector_pronto
+    if _detector_pronto:
+        return
+    _detector_pronto = True
+    detector = obter_detector()
+    for backend in detector.backends:
+        detector._executar(backend, _imagem_aquecimento())
+    detector.zerar_estatisticas()
+
+def preparar_reconhecimento() -> None:
+    """Constrói o modelo de reconhecimento no processo atual com uma inferência de aquecimento."""
+    global _modelo_reconhecimento
+    if _modelo_reconhecimento is not None:
+        return
+    _modelo_reconhecimento = DeepFace.build_model(Configuracao.MODELO)
+    if Configuracao.INFERENCIA_EM_LOTE:
+        representar_rostos([_imagem_aquecimento()])
+    else:
+        _representar_deepface(_imagem_aquecimento())
+
+def preparar_modelos() -> None:
+    """Constrói o detector e o modelo de reconhecimento no processo atual, com aquecimento.
+
+    O DeepFace mantém os modelos em cache por processo, então as chamadas seguintes a
+    DeepFace.represent e DeepFace.extract_faces reaproveitam o que foi carregado aqui.
+    """
+    preparar_detector()
+    preparar_reconhecimento()
 
 def validar_imagem(caminho: Path) -> bool:
     try:
@@ -31,6 +225,149 @@ def validar_imagem(caminho: Path) -> bool:
         logger.error(f"Erro ao validar imagem {caminho}: {e}")
         return False
 
+def duas_resolucoes_ativas() -> bool:
+    # O caminho via DeepFace.represent detecta e recorta sozinho, sem acesso à imagem cheia
+    return Configuracao.DETECCAO_EM_DUAS_RESOLUCOES and Configuracao.INFERENCIA_EM_LOTE
+
+def tamanho_maximo_decodificacao() -> Tuple[int, int]:
+    """Tamanho em que as imagens são mantidas após a decodificação."""
+    if duas_resolucoes_ativas():
+        return Configuracao.TAMANHO_MAXIMO_RECORTE
+    return Configuracao.TAMANHO_MAXIMO
+
+def redimensionar_imagem(imagem: np.ndarray, tamanho_maximo: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """Reduz a imagem para caber em tamanho_maximo (por padrão, TAMANHO_MAXIMO), mantendo a proporção."""
+    tamanho_maximo = tamanho_maximo or Configuracao.TAMANHO_MAXIMO
+    altura, largura = imagem.shape[:2]
+    if largura <= tamanho_maximo[0] and altura <= tamanho_maximo[1]:
+        return imagem
+    proporcao = min(tamanho_maximo[0] / largura, tamanho_maximo[1] / altura)
+    nova_largura = int(largura * proporcao)
+    nova_altura = int(altura * proporcao)
+    return cv2.resize(imagem, (nova_largura, nova_altura), interpolation=cv2.INTER_AREA)
+
+ORIENTACAO_EXIF = 0x0112
+IFD_EXIF = 0x8769
+DATA_ORIGINAL_EXIF = 0x9003
+SUBSEGUNDOS_ORIGINAL_EXIF = 0x9291
+# Foto sem nenhum rosto na miniatura EXIF: não foi decodificada e não precisa passar pela detecção
+IMAGEM_SEM_ROSTOS = np.zeros((0, 0, 3), dtype=np.uint8)
+TRANSPOSICOES_EXIF = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+def extrair_miniatura_exif(pil_img: Image.Image) -> Optional[Image.Image]:
+    """Retorna a miniatura JPEG embutida no bloco EXIF (APP1), sem decodificar a foto."""
+    for marcador, dados in getattr(pil_img, "applist", []):
+        if marcador != "APP1" or not dados.startswith(b"Exif\x00\x00"):
+            continue
+        inicio = dados.find(b"\xff\xd8", 6)
+        fim = dados.rfind(b"\xff\xd9")
+        if inicio < 0 or fim <= inicio:
+            return None
+        try:
+            miniatura = Image.open(io.BytesIO(dados[inicio:fim + 2]))
+            miniatura.load()
+            return miniatura
+        except Exception:
+            return None
+    return None
+
+def miniatura_sem_rostos(conteudo: bytes) -> bool:
+    """Indica se a foto tem miniatura EXIF utilizável e nenhum rosto foi encontrado nela."""
+    try:
+        with Image.open(io.BytesIO(conteudo)) as pil_img:
+            miniatura = extrair_miniatura_exif(pil_img)
+            orientacao = pil_img.getexif().get(ORIENTACAO_EXIF, 1)
+    except Exception:
+        return False
+    if miniatura is None or max(miniatura.size) < Configuracao.LADO_MINIMO_MINIATURA:
+        return False
+    # A miniatura é gravada com a mesma orientação do sensor que a foto principal
+    if orientacao in TRANSPOSICOES_EXIF:
+        miniatura = miniatura.transpose(TRANSPOSICOES_EXIF[orientacao])
+    imagem = np.ascontiguousarray(np.array(miniatura.convert("RGB"))[:, :, ::-1])
+    # Mesma regra da foto decodificada: o detector já descarta o quadro inteiro devolvido quando não há rosto
+    return not obter_detector().detectar(imagem, alinhar=False)
+
+def calcular_hash_perceptual(caminho: Path) -> Optional[int]:
+    """dHash de 64 bits, calculado sobre uma decodificação JPEG reduzida a 1/8 e em tons de cinza."""
+    try:
+        with Image.open(caminho) as pil_img:
+            orientacao = pil_img.getexif().get(ORIENTACAO_EXIF, 1)
+            pil_img.draft("L", (max(1, pil_img.width // 8), max(1, pil_img.height // 8)))
+            reduzida = pil_img.convert("L")
+        if orientacao in TRANSPOSICOES_EXIF:
+            reduzida = reduzida.transpose(TRANSPOSICOES_EXIF[orientacao])
+        pixels = np.asarray(reduzida.resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    except Exception as e:
+        logger.warning(f"Erro ao calcular hash perceptual de {caminho}: {e}")
+        return None
+    # Cada bit indica se o pixel é mais claro que o vizinho à esquerda
+    return int.from_bytes(np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes(), 'big')
+
+def horario_captura(caminho: Path) -> Optional[float]:
+    """Instante em que a foto foi tirada (DateTimeOriginal do EXIF, com fração de segundo), ou None."""
+    try:
+        with Image.open(caminho) as pil_img:
+            exif = pil_img.getexif().get_ifd(IFD_EXIF)
+        data = exif.get(DATA_ORIGINAL_EXIF)
+        if not data:
+            return None
+        instante = datetime.strptime(str(data).strip("\x00 "), "%Y:%m:%d %H:%M:%S").timestamp()
+        subsegundos = str(exif.get(SUBSEGUNDOS_ORIGINAL_EXIF, "")).strip("\x00 ")
+        if subsegundos.isdigit():
+            instante += int(subsegundos) / 10 ** len(subsegundos)
+        return instante
+    except Exception:
+        return None
+
+def reduzir_decodificacao(pil_img: Image.Image, tamanho_maximo: Tuple[int, int]) -> None:
+    """Pede ao decodificador JPEG a maior redução (1/2, 1/4 ou 1/8) que ainda cobre o tamanho final.
+
+    A redução acontece no domínio DCT, então a imagem nem chega a ser decodificada em
+    resolução cheia; o ajuste fino continua com redimensionar_imagem. Outros formatos ignoram.
+    """
+    if pil_img.getexif().get(ORIENTACAO_EXIF, 1) in (5, 6, 7, 8):
+        tamanho_maximo = (tamanho_maximo[1], tamanho_maximo[0])  # A foto será girada 90° depois
+    largura, altura = pil_img.size
+    proporcao = min(tamanho_maximo[0] / largura, tamanho_maximo[1] / altura)
+    if proporcao >= 1 or pil_img.format != "JPEG":
+        return
+    pil_img.draft("RGB", (math.ceil(largura * proporcao), math.ceil(altura * proporcao)))
+
+def carregar_imagem(caminho: Path, conteudo: Optional[bytes] = None, tempos: Optional[TemposFoto] = None) -> Optional[np.ndarray]:
+    """Decodifica a imagem uma única vez e a retorna em BGR, já redimensionada.
+
+    A orientação EXIF é aplicada. Se o conteúdo do arquivo já foi lido, ele é decodificado
+    direto da memória. No modo de duas resoluções a imagem é mantida grande; a redução
+    para a detecção fica em extrair_rostos.
+    """
+    try:
+        with medir(tempos, 'decodificacao'), Image.open(io.BytesIO(conteudo) if conteudo is not None else caminho) as pil_img:
+            if Configuracao.DECODIFICACAO_REDUZIDA:
+                reduzir_decodificacao(pil_img, tamanho_maximo_decodificacao())
+            # Fotos em retrato gravadas "deitadas" com a orientação só no EXIF
+            pil_img = ImageOps.exif_transpose(pil_img).convert("RGB")
+            imagem = np.ascontiguousarray(np.array(pil_img)[:, :, ::-1])  # RGB para BGR
+    except Exception as e:
+        logger.error(f"Erro ao abrir imagem com PIL {caminho}: {e}")
+        return None
+    altura, largura = imagem.shape[:2]
+    logger.debug(f"Imagem carregada: {caminho}, tamanho: {largura}x{altura}")
+    try:
+        with medir(tempos, 'redimensionamento'):
+            return redimensionar_imagem(imagem, tamanho_maximo_decodificacao())
+    except (cv2.error, ValueError) as e:
+        logger.error(f"Erro ao redimensionar imagem {caminho}: {e}")
+        return None
+
 def pre_processar_imagem(caminho_origem: Path, caminho_destino: Path) -> bool:
     try:
         logger.debug(f"Tentando validar imagem: {caminho_origem}")
@@ -38,32 +375,13 @@ def pre_processar_imagem(caminho_origem: Path, caminho_destino: Path) -> bool:
             logger.error(f"Validação falhou para {caminho_origem}")
             return False
 
-        try:
-            with Image.open(caminho_origem) as pil_img:
-                pil_img = pil_img.convert("RGB")
-                imagem = np.array(pil_img)[:, :, ::-1]  # RGB para BGR
-        except Exception as e:
-            logger.error(f"Erro ao abrir imagem com PIL {caminho_origem}: {e}")
+        imagem = carregar_imagem(caminho_origem)
+        if imagem is None:
             return False
 
-        altura, largura = imagem.shape[:2]
-        logger.debug(f"Imagem carregada: {caminho_origem}, tamanho: {largura}x{altura}")
-
-        if largura <= Configuracao.TAMANHO_MAXIMO[0] and altura <= Configuracao.TAMANHO_MAXIMO[1]:
-            logger.debug(f"Salvando imagem sem redimensionamento: {caminho_destino}")
-            if not cv2.imwrite(str(caminho_destino), imagem):
-                logger.error(f"Falha ao salvar imagem sem redimensionamento: {caminho_destino}")
-                return False
-            return True
-
-        proporcao = min(Configuracao.TAMANHO_MAXIMO[0] / largura, Configuracao.TAMANHO_MAXIMO[1] / altura)
-        nova_largura = int(largura * proporcao)
-        nova_altura = int(altura * proporcao)
-        imagem = cv2.resize(imagem, (nova_largura, nova_altura), interpolation=cv2.INTER_AREA)
-
-        logger.debug(f"Salvando imagem redimensionada: {caminho_destino}")
+        logger.debug(f"Salvando imagem pré-processada: {caminho_destino}")
         if not cv2.imwrite(str(caminho_destino), imagem):
-            logger.error(f"Falha ao salvar imagem redimensionada: {caminho_destino}")
+            logger.error(f"Falha ao salvar imagem pré-processada: {caminho_destino}")
             return False
 
         return True
@@ -71,39 +389,304 @@ def pre_processar_imagem(caminho_origem: Path, caminho_destino: Path) -> bool:
         logger.error(f"Erro ao pré-processar imagem {caminho_origem}: {str(e)}")
         return False
 
-def carregar_codificacoes_rostos(caminho: Path) -> List[np.ndarray]:
+# Área de um rosto como (x, y, largura, altura) relativas às dimensões da imagem analisada
+AreaRosto = Tuple[float, float, float, float]
+
+def _area_relativa(area: dict, largura: int, altura: int) -> AreaRosto:
+    return (
+        area.get("x", 0) / largura,
+        area.get("y", 0) / altura,
+        area.get("w", largura) / largura,
+        area.get("h", altura) / altura,
+    )
+
+def recortar_rosto(imagem: np.ndarray, area: dict, escala: float) -> np.ndarray:
+    """Recorta da imagem cheia (BGR) um rosto detectado na cópia reduzida, alinhando pelos olhos como o DeepFace.
+
+    escala é a razão entre a cópia reduzida e a imagem cheia; o recorte sai em BGR, 0–1.
+    """
+    altura_img, largura_img = imagem.shape[:2]
+    x, y = area.get("x", 0) / escala, area.get("y", 0) / escala
+    largura, altura = area.get("w", largura_img * escala) / escala, area.get("h", altura_img * escala) / escala
+    olho_esquerdo, olho_direito = area.get("left_eye"), area.get("right_eye")
+    if olho_esquerdo is not None and olho_direito is not None:
+        angulo = float(np.degrees(np.arctan2(olho_esquerdo[1] - olho_direito[1], olho_esquerdo[0] - olho_direito[0])))
+    else:
+        angulo = 0.0
+    if angulo:
+        # Gira só uma janela ao redor do rosto, grande o bastante para cobrir a rotação
+        centro_x, centro_y = x + largura / 2, y + altura / 2
+        raio = int(np.ceil(np.hypot(largura, altura) / 2))
+        x0, y0 = max(0, int(centro_x) - raio), max(0, int(centro_y) - raio)
+        janela = imagem[y0:int(centro_y) + raio, x0:int(centro_x) + raio]
+        matriz = cv2.getRotationMatrix2D((centro_x - x0, centro_y - y0), angulo, 1.0)
+        janela = cv2.warpAffine(janela, matriz, (janela.shape[1], janela.shape[0]), flags=cv2.INTER_LINEAR)
+        imagem, x, y = janela, x - x0, y - y0
+    x0, y0 = max(0, int(round(x))), max(0, int(round(y)))
+    x1, y1 = min(imagem.shape[1], int(round(x + largura))), min(imagem.shape[0], int(round(y + altura)))
+    return imagem[y0:y1, x0:x1].astype(np.float32) / 255.0
+
+def extrair_rostos(imagem: np.ndarray, tempos: Optional[TemposFoto] = None) -> Tuple[List[np.ndarray], List[AreaRosto]]:
+    """Detecta e alinha os rostos de uma imagem BGR, retornando os recortes (BGR, 0–1) e suas áreas.
+
+    No modo de duas resoluções a detecção roda numa cópia com LADO_DETECCAO pixels no maior
+    lado e os rostos são recortados da imagem recebida, em resolução cheia.
+    """
+    if imagem.size == 0:
+        return [], []
+    altura, largura = imagem.shape[:2]
+    escala = Configuracao.LADO_DETECCAO / max(altura, largura)
+    if not duas_resolucoes_ativas() or escala >= 1:
+        with medir(tempos, 'deteccao'):
+            resultados = obter_detector().detectar(imagem)
+        rostos = []
+        areas = []
+        for r in resultados:
+            rosto = np.asarray(r["face"])
+            if rosto.ndim == 4:
+                rosto = rosto[0]
+            rostos.append(rosto[:, :, ::-1])  # O DeepFace entrega o recorte em RGB; a rede recebe BGR
+            areas.append(_area_relativa(r.get("facial_area", {}), largura, altura))
+        return rostos, areas
+
+    with medir(tempos, 'redimensionamento'):
+        reduzida = cv2.resize(imagem, (max(1, round(largura * escala)), max(1, round(altura * escala))), interpolation=cv2.INTER_AREA)
+    with medir(tempos, 'deteccao'):
+        resultados = obter_detector().detectar(reduzida, alinhar=False)
+    rostos = []
+    areas = []
+    with medir(tempos, 'recorte'):
+        for r in resultados:
+            area = r.get("facial_area", {})
+            rosto = recortar_rosto(imagem, area, escala)
+            if rosto.size == 0:
+                continue
+            rostos.append(rosto)
+            areas.append(_area_relativa(area, reduzida.shape[1], reduzida.shape[0]))
+    return rostos, areas
+
+def compactar_recorte(rosto: np.ndarray) -> np.ndarray:
+    """Converte um recorte 0–1 de volta para uint8, para trafegar entre processos com 1/8 do tamanho.
+
+    O DeepFace recorta a imagem uint8 e só então divide por 255, então a conversão é exata.
+    """
+    if rosto.dtype == np.uint8:
+        return rosto
+    return np.clip(np.rint(rosto * 255), 0, 255).astype(np.uint8)
+
+def _rede_reconhecimento() -> Tuple[object, Tuple[int, int]]:
+    """Retorna a rede Keras do modelo de reconhecimento e seu tamanho de entrada (altura, largura)."""
+    preparar_reconhecimento()
+    rede = getattr(_modelo_reconhecimento, "model", _modelo_reconhecimento)
+    forma = getattr(_modelo_reconhecimento, "input_shape", None)
+    if forma is None or len(forma) != 2:
+        forma = tuple(rede.input_shape[1:3])
+    return rede, (int(forma[0]), int(forma[1]))
+
+def _ajustar_rosto(rosto: np.ndarray, altura: int, largura: int) -> np.ndarray:
+    """Redimensiona mantendo a proporção e completa com preto até a entrada da rede, como o DeepFace faz."""
+    if rosto.max() > 1:
+        rosto = rosto.astype(np.float32) / 255.0
+    h, w = rosto.shape[:2]
+    fator = min(altura / h, largura / w)
+    rosto = cv2.resize(np.ascontiguousarray(rosto, dtype=np.float32), (max(1, int(w * fator)), max(1, int(h * fator))))
+    dif_altura = altura - rosto.shape[0]
+    dif_largura = largura - rosto.shape[1]
+    rosto = np.pad(
+        rosto,
+        ((dif_altura // 2, dif_altura - dif_altura // 2), (dif_largura // 2, dif_largura - dif_largura // 2), (0, 0)),
+        "constant"
+    )
+    if rosto.shape[:2] != (altura, largura):
+        rosto = cv2.resize(rosto, (largura, altura))
+    return rosto
+
+def representar_rostos(rostos: List[np.ndarray]) -> np.ndarray:
+    """Gera as codificações de vários recortes executando a rede uma vez por lote de TAMANHO_LOTE_INFERENCIA.
+
+    O último lote é completado com zeros até a próxima potência de dois, limitando os
+    formatos distintos que a rede precisa compilar.
+    """
+    if not rostos:
+        return np.zeros((0, 0), dtype=np.float32)
+    rede, (altura, largura) = _rede_reconhecimento()
+    tamanho_lote = max(1, Configuracao.TAMANHO_LOTE_INFERENCIA)
+    entradas = np.stack([_ajustar_rosto(r, altura, largura) for r in rostos])
+    codificacoes = []
+    for inicio in range(0, len(entradas), tamanho_lote):
+        lote = entradas[inicio:inicio + tamanho_lote]
+        quantidade = len(lote)
+        alvo = min(tamanho_lote, 1 << (quantidade - 1).bit_length())
+        if quantidade < alvo:
+            lote = np.concatenate([lote, np.zeros((alvo - quantidade, *lote.shape[1:]), dtype=lote.dtype)])
+        codificacoes.append(np.asarray(rede.predict_on_batch(lote), dtype=np.float32)[:quantidade])
+    return np.concatenate(codificacoes)
+
+def codificar_lote(imagens: List[np.ndarray], tempos: Optional[List[Optional[TemposFoto]]] = None) -> List[Tuple[List[np.ndarray], List[AreaRosto]]]:
+    """Detecta os rostos de várias imagens, codifica todos os recortes em lotes e devolve o resultado de cada imagem.
+
+    Com `tempos` (um por imagem), o tempo da codificação em lote é dividido pelas fotos conforme o número de rostos.
+    """
+    tempos = tempos or [None] * len(imagens)
+    deteccoes = []
+    for imagem, tempos_foto in zip(imagens, tempos):
+        try:
+            deteccoes.append(extrair_rostos(imagem, tempos_foto))
+        except Exception as e:
+            logger.error(f"Erro ao detectar rostos: {e}")
+            deteccoes.append(([], []))
+    inicio = time.perf_counter()
+    vetores = representar_rostos([rosto for rostos, _ in deteccoes for rosto in rostos])
+    repartir_tempo(tempos, [len(rostos) for rostos, _ in deteccoes], 'codificacao', time.perf_counter() - inicio)
+    resultados = []
+    posicao = 0
+    for rostos, areas in deteccoes:
+        resultados.append((list(vetores[posicao:posicao + len(rostos)]), areas))
+        posicao += len(rostos)
+    return resultados
+
+def _representar_deepface(imagem: np.ndarray) -> Tuple[List[np.ndarray], List[AreaRosto]]:
+    """Detecção e codificação de uma única imagem via DeepFace.represent."""
+    altura, largura = imagem.shape[:2]
+    resultados = DeepFace.represent(
+        img_path=imagem,
+        model_name=Configuracao.MODELO,
+        detector_backend=Configuracao.DETECTOR,
+        enforce_detection=False
+    )
+    codificacoes = []
+    areas = []
+    for r in resultados:
+        # O quadro inteiro sem rosto também vem codificado; descartá-lo mantém a regra da detecção em cascata
+        if "embedding" not in r or quadro_inteiro(r, largura, altura):
+            continue
+        codificacoes.append(np.array(r["embedding"]))
+        areas.append(_area_relativa(r.get("facial_area", {}), largura, altura))
+    return codificacoes, areas
+
+def carregar_rostos(entrada: Union[Path, np.ndarray]) -> Tuple[List[np.ndarray], List[AreaRosto]]:
+    """Extrai as codificações e as áreas dos rostos de um arquivo ou de uma imagem BGR já decodificada."""
+    em_memoria = isinstance(entrada, np.ndarray)
+    descricao = "imagem em memória" if em_memoria else entrada
     try:
-        if not validar_imagem(caminho):
-            return []
-        resultados = DeepFace.represent(
-            img_path=str(caminho),
-            model_name=Configuracao.MODELO,
-            detector_backend=Configuracao.DETECTOR,
-            enforce_detection=False
-        )
-        codificacoes = [np.array(r["embedding"]) for r in resultados if "embedding" in r]
+        if em_memoria:
+            imagem = entrada
+        else:
+            if not validar_imagem(entrada):
+                return [], []
+            imagem = carregar_imagem(entrada)
+            if imagem is None:
+                return [], []
+        if imagem.size == 0:
+            codificacoes, areas = [], []
+        elif Configuracao.INFERENCIA_EM_LOTE:
+            codificacoes, areas = codificar_lote([imagem])[0]
+        else:
+            codificacoes, areas = _representar_deepface(imagem)
         if not codificacoes:
-            logger.warning(f"Nenhum rosto detectado em {caminho}")
-        return codificacoes
+            logger.warning(f"Nenhum rosto detectado em {descricao}")
+        return codificacoes, areas
     except Exception as e:
-        logger.error(f"Erro ao carregar codificações de {caminho}: {e}")
-        return []
+        logger.error(f"Erro ao carregar codificações de {descricao}: {e}")
+        return [], []
 
-def comparar_rostos(codificacoes_conhecidas: List[np.ndarray], codificacao_rosto: np.ndarray) -> bool:
-    """Compara a codificação de um rosto com uma lista de codificações conhecidas usando distância cosseno."""
-    try:
-        for codificacao_conhecida in codificacoes_conhecidas:
-            # Distância cosseno
-            dot = np.dot(codificacao_conhecida, codificacao_rosto)
-            norma_a = norm(codificacao_conhecida)
-            norma_b = norm(codificacao_rosto)
-            if norma_a == 0 or norma_b == 0:
-                continue
-            similaridade = dot / (norma_a * norma_b)
-            distancia = 1 - similaridade  # quanto menor, mais parecido
-            if distancia <= Configuracao.TOLERANCIA:
-                return True
-        return False
-    except Exception as e:
-        logger.error(f"Erro ao comparar rostos manualmente: {e}")
-        return False
+def carregar_codificacoes_rostos(entrada: Union[Path, np.ndarray]) -> List[np.ndarray]:
+    """Extrai as codificações de rostos de um arquivo ou de uma imagem BGR já decodificada."""
+    return carregar_rostos(entrada)[0]
+
+def codificar_imagem(caminho: Path, caminho_temp: Path) -> Optional[List[np.ndarray]]:
+    """Decodifica, redimensiona e extrai as codificações de uma imagem.
+
+    Com PIPELINE_EM_MEMORIA a imagem redimensionada vai direto para o DeepFace; caso
+    contrário passa por um arquivo em caminho_temp. Retorna None se a imagem não pôde ser lida.
+    """
+    if Configuracao.PIPELINE_EM_MEMORIA:
+        imagem = carregar_imagem(caminho)
+        return None if imagem is None else carregar_codificacoes_rostos(imagem)
+    if not pre_processar_imagem(caminho, caminho_temp):
+        return None
+    return carregar_codificacoes_rostos(caminho_temp)
+
+def normalizar_linhas(matriz: np.ndarray) -> np.ndarray:
+    """Normaliza cada linha para norma unitária (linhas nulas permanecem nulas)."""
+    normas = norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1
+    return np.ascontiguousarray(matriz / normas, dtype=np.float32)
+
+class GaleriaRostos:
+    """Codificações de referência pré-normalizadas em uma única matriz float32, com índice linha→pessoa."""
+
+    def __init__(self, rostos_conhecidos: Dict[str, List[np.ndarray]]):
+        self.nomes: List[str] = list(rostos_conhecidos)
+        linhas = [c for nome in self.nomes for c in rostos_conhecidos[nome]]
+        self.indice_pessoa = np.array(
+            [i for i, nome in enumerate(self.nomes) for _ in rostos_conhecidos[nome]], dtype=np.int32
+        )
+        matriz = np.asarray(linhas, dtype=np.float32) if linhas else np.zeros((0, 0), dtype=np.float32)
+        self.matriz = normalizar_linhas(matriz) if linhas else matriz
+        self.indice: Optional[IndiceIVF] = None
+
+    def __len__(self) -> int:
+        return len(self.indice_pessoa)
+
+    def assinatura(self) -> str:
+        """Identifica o conteúdo da galeria e os parâmetros de comparação, para invalidar resultados antigos."""
+        resumo = hashlib.blake2b(digest_size=16)
+        resumo.update(f"{Configuracao.MODELO}|{identificador_detector()}|{Configuracao.TOLERANCIA}".encode())
+        resumo.update(json.dumps(self.nomes).encode())
+        resumo.update(np.ascontiguousarray(self.indice_pessoa).tobytes())
+        resumo.update(np.ascontiguousarray(self.matriz).tobytes())
+        return resumo.hexdigest()
+
+    def preparar_indice(self, arquivo_indice: Path) -> None:
+        """Ativa o índice ANN para galerias grandes, reaproveitando o índice salvo quando a galeria não mudou."""
+        if not Configuracao.USAR_INDICE_ANN or len(self) < Configuracao.ANN_MINIMO_REFERENCIAS:
+            return
+        indice = IndiceIVF.carregar(arquivo_indice, assinatura_matriz(self.matriz))
+        if indice is None:
+            logger.info(f"Construindo índice ANN para {len(self)} codificações de referência")
+            indice = IndiceIVF.construir(self.matriz)
+            indice.salvar(arquivo_indice)
+        self.indice = indice
+
+    def publicar(self, arquivo: Path) -> dict:
+        """Grava a matriz em um .npy único por execução e retorna o descritor leve enviado aos workers."""
+        np.save(arquivo, self.matriz)
+        return {'arquivo': str(arquivo), 'nomes': self.nomes, 'indice_pessoa': self.indice_pessoa, 'indice': self.indice}
+
+    @classmethod
+    def anexar(cls, descritor: dict) -> 'GaleriaRostos':
+        """Abre a galeria publicada como mapa de memória somente leitura, compartilhado entre os processos."""
+        galeria = cls.__new__(cls)
+        galeria.nomes = descritor['nomes']
+        galeria.indice_pessoa = descritor['indice_pessoa']
+        galeria.matriz = np.load(descritor['arquivo'], mmap_mode='r')
+        galeria.indice = descritor.get('indice')
+        return galeria
+
+    def comparar(self, codificacoes: List[np.ndarray]) -> List[Tuple[Optional[str], float]]:
+        """Compara todos os rostos de uma foto com a galeria inteira em uma única multiplicação de matrizes.
+
+        Com o índice ANN ativo, apenas as listas mais próximas são consultadas. Retorna, para
+        cada rosto, a pessoa mais próxima e a distância cosseno correspondente.
+        """
+        if len(codificacoes) == 0:
+            return []
+        if len(self) == 0:
+            return [(None, 1.0)] * len(codificacoes)
+        consultas = normalizar_linhas(np.asarray(codificacoes, dtype=np.float32))
+        if self.indice is not None:
+            # Os candidatos das listas visitadas já são pontuados com os vetores completos: basta o melhor
+            linhas, similaridades = self.indice.buscar(self.matriz, consultas, Configuracao.ANN_SONDAS, 1)
+            return [
+                (self.nomes[self.indice_pessoa[linha]], float(1 - similaridade)) if linha >= 0 else (None, 1.0)
+                for linha, similaridade in zip(linhas[:, 0], similaridades[:, 0])
+            ]
+        similaridades = consultas @ self.matriz.T
+        melhores = np.argmax(similaridades, axis=1)
+        distancias = 1 - similaridades[np.arange(len(melhores)), melhores]
+        return [(self.nomes[self.indice_pessoa[linha]], float(d)) for linha, d in zip(melhores, distancias)]
+
+    def identificar(self, codificacoes: List[np.ndarray]) -> Set[str]:
+        """Retorna as pessoas cuja melhor correspondência está dentro da tolerância."""
+        return {nome for nome, distancia in self.comparar(codificacoes) if distancia <= Configuracao.TOLERANCIA}
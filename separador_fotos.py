@@ -1,101 +1,440 @@
 import multiprocessing
 import os
-import shutil
 import logging
-from logging.handlers import QueueHandler
 import json
+import sqlite3
 from datetime import datetime
-from multiprocessing import Pool, cpu_count, Manager
+from multiprocessing import Pool, cpu_count
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, Callable, Any
 import math
-from queue import Queue
+import itertools
+import time
+import threading
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
 import numpy as np
 from deepface import DeepFace
 
-from processamento_imagem import pre_processar_imagem, carregar_codificacoes_rostos, comparar_rostos, Configuracao
-from utilitarios_arquivos import normalizar_caminho, diretorio_temporario, listar_imagens, carregar_rostos_conhecidos, salvar_rostos_conhecidos
+from processamento_imagem import pre_processar_imagem, carregar_imagem, carregar_rostos, codificar_imagem, extrair_rostos, compactar_recorte, representar_rostos, Configuracao, GaleriaRostos, preparar_modelos, preparar_detector, preparar_reconhecimento, obter_detector, identificador_detector, miniatura_sem_rostos, IMAGEM_SEM_ROSTOS, calcular_hash_perceptual, horario_captura
+from utilitarios_arquivos import normalizar_caminho, diretorio_temporario, listar_imagens, varrer_imagens, colocar_arquivo, reiniciar_modos_colocacao, MODOS_COLOCACAO, identificador_foto, RegistroNomesSaida, ARQUIVO_INDICE, carregar_rostos_conhecidos, salvar_rostos_conhecidos, calcular_hash_arquivo, calcular_hash_conteudo
+from deduplicacao import AgrupadorDuplicatas
+from contadores_compartilhados import ContadoresCompartilhados, ContadorProcessadas, FilaProgresso
+from transporte_logs import ManipuladorLogsEmLote
+from perfil_execucao import PerfilExecucao, TemposFoto, medir, repartir_tempo, ARQUIVO_PERFIL
+from manifesto_execucao import ManifestoExecucao, STATUS_IDENTIFICADA, STATUS_DESCONHECIDA, STATUS_SEM_ROSTOS, STATUS_ERRO
 
 logger = logging.getLogger(__name__)
 
-# Função independente para pré-processamento em Pool
-def processar_imagem_pre(caminho: Path, diretorio_temp: Path, indice: int, total: int, cancelado: 'multiprocessing.managers.ValueProxy', fila_progresso: 'multiprocessing.managers.QueueProxy') -> Optional[Path]:
-    if cancelado.value:
+ARQUIVO_MANIFESTO = "manifesto.sqlite"
+PASTA_DESCONHECIDOS = "desconhecidos"
+VARIAVEIS_THREADS_BLAS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+def calcular_num_processos() -> int:
+    """Determina o número de processos com base nos núcleos."""
+    num_nucleos = cpu_count()
+    if num_nucleos <= 2:
+        return 1
+    return max(1, math.floor(num_nucleos * 0.8))
+
+
+def calcular_processos_estagios() -> Tuple[int, int]:
+    """Divide os processos entre codificação e detecção; valores configurados têm prioridade."""
+    total = calcular_num_processos()
+    num_codificacao = Configuracao.PROCESSOS_CODIFICACAO or max(1, total // 3)
+    num_deteccao = Configuracao.PROCESSOS_DETECCAO or max(1, total - num_codificacao)
+    return num_codificacao, num_deteccao
+
+
+def planejar_threads(num_processos: int) -> Optional[Dict[str, int]]:
+    """Define quantas threads o TensorFlow, o OpenCV e o BLAS podem usar em cada processo."""
+    if not Configuracao.LIMITAR_THREADS:
         return None
-    nome_arquivo = caminho.name
-    caminho_destino = diretorio_temp / f"pre_{nome_arquivo}"
-    if pre_processar_imagem(caminho, caminho_destino):
-        logger.info(f"[{indice}/{total}] Imagem pré-processada: {nome_arquivo}")
-        fila_progresso.put(1)
-        return caminho_destino
-    return None
+    por_processo = Configuracao.THREADS_POR_PROCESSO or max(1, cpu_count() // max(1, num_processos))
+    return {
+        'intra_op': por_processo,
+        'inter_op': max(1, Configuracao.THREADS_INTER_OP),
+        'opencv': Configuracao.THREADS_OPENCV or por_processo,
+        'blas': Configuracao.THREADS_BLAS or por_processo,
+    }
 
 
-# Função independente para processamento de imagens em Pool
-def processar_imagem(caminho_imagem: Path, rostos_conhecidos: Dict[str, List[np.ndarray]], pasta_saida: Path, indice: int, total: int, caminho_original: Path, cancelado: 'multiprocessing.managers.ValueProxy', fila_progresso: 'multiprocessing.managers.QueueProxy', evento_processamento: 'multiprocessing.managers.Event', contador_processadas: 'multiprocessing.managers.ValueProxy') -> None:
-    if cancelado.value:
+def pipeline_estagios_ativo() -> bool:
+    # O estágio de codificação sempre usa a cascata e a rede em lote; sem INFERENCIA_EM_LOTE fica o Pool com DeepFace.represent
+    return Configuracao.PIPELINE_EM_ESTAGIOS and Configuracao.PIPELINE_EM_MEMORIA and Configuracao.INFERENCIA_EM_LOTE
+
+
+def planejar_threads_execucao() -> Optional[Dict[str, int]]:
+    """Plano de threads para o caminho de reconhecimento que a configuração vai executar."""
+    if pipeline_estagios_ativo():
+        return planejar_threads(sum(calcular_processos_estagios()))
+    return planejar_threads(calcular_num_processos())
+
+
+def aplicar_limites_threads(plano: Optional[Dict[str, int]]) -> None:
+    """Aplica o plano de threads no processo atual."""
+    if plano is None:
         return
-    while not evento_processamento.is_set():
-        if cancelado.value:
+    # Variáveis de ambiente valem para bibliotecas ainda não carregadas (e processos iniciados com spawn)
+    for variavel in VARIAVEIS_THREADS_BLAS:
+        os.environ[variavel] = str(plano['blas'])
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(plano['intra_op'])
+    os.environ["TF_NUM_INTEROP_THREADS"] = str(plano['inter_op'])
+    cv2.setNumThreads(plano['opencv'])
+    try:
+        # O BLAS já carregado pelo numpy só muda em tempo de execução
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=plano['blas'])
+    except ImportError:
+        pass
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(plano['intra_op'])
+        tf.config.threading.set_inter_op_parallelism_threads(plano['inter_op'])
+    except ImportError:
+        pass
+    except RuntimeError as e:
+        # O runtime do TensorFlow já foi iniciado (por exemplo, herdado do processo principal via fork)
+        logger.warning(f"Worker {os.getpid()}: não foi possível limitar as threads do TensorFlow: {e}")
+
+
+def agrupar(itens: Iterable[Any], tamanho: int) -> Iterator[List[Any]]:
+    """Divide um iterável (possivelmente ainda sendo produzido) em listas de até `tamanho` itens."""
+    iterador = iter(itens)
+    while True:
+        grupo = list(itertools.islice(iterador, tamanho))
+        if not grupo:
             return
-        evento = Manager().Event()
-        evento.wait(0.1)
+        yield grupo
+
+
+# Executa uma tarefa (função, argumentos) recebida via imap_unordered
+def executar_tarefa(tarefa: Tuple[Callable, tuple]) -> Any:
+    funcao, argumentos = tarefa
+    return funcao(*argumentos)
+
+
+# Estado compartilhado recebido por cada processo do Pool no inicializador
+_estado_worker: Dict[str, Any] = {}
+
+
+# Bloqueia o worker enquanto o processamento estiver pausado; retorna False se foi cancelado
+def aguardar_liberacao() -> bool:
+    cancelado = _estado_worker['cancelado']
+    if cancelado.value:
+        return False
+    # cancelar_processamento também sinaliza o evento, então a espera nunca fica presa
+    _estado_worker['evento_processamento'].wait()
+    return not cancelado.value
+
+
+# Inicializador dos processos do Pool e dos estágios do pipeline
+def inicializar_worker(cancelado: 'multiprocessing.sharedctypes.Synchronized', evento_processamento: 'multiprocessing.synchronize.Event', contadores: ContadoresCompartilhados, descritor_galeria: Optional[dict], plano_threads: Optional[Dict[str, int]] = None, preparar: Callable[[], None] = preparar_modelos) -> None:
+    # Os limites precisam valer antes de os modelos criarem seus pools de threads
+    aplicar_limites_threads(plano_threads)
+    _estado_worker['cancelado'] = cancelado
+    _estado_worker['evento_processamento'] = evento_processamento
+    _estado_worker['contadores'] = contadores
+    # A galeria é anexada uma única vez por processo, sem ser serializada a cada tarefa
+    if descritor_galeria is not None:
+        _estado_worker['galeria'] = GaleriaRostos.anexar(descritor_galeria)
+    inicio = time.perf_counter()
     try:
-        codificacoes = carregar_codificacoes_rostos(caminho_imagem)
+        preparar()
+        logger.info(f"Worker {os.getpid()} pronto: {preparar.__name__} ({Configuracao.MODELO}/{identificador_detector()}) em {time.perf_counter() - inicio:.2f}s")
+    except Exception as e:
+        # Sem o aquecimento o DeepFace ainda carrega os modelos na primeira tarefa
+        logger.error(f"Worker {os.getpid()}: falha ao pré-carregar modelos: {e}")
+
+
+# Função independente para pré-processamento em Pool; o arquivo temporário leva o id da foto
+def processar_imagem_pre(registro: dict, diretorio_temp: Path, total: int) -> dict:
+    if not aguardar_liberacao():
+        return registro
+    caminho = Path(registro['caminho'])
+    caminho_destino = diretorio_temp / f"pre_{registro['id']}{caminho.suffix}"
+    with medir(registro['tempos'], 'pre_processamento'):
+        valida = pre_processar_imagem(caminho, caminho_destino)
+    if valida:
+        logger.info(f"[{registro['indice']}/{total}] Imagem pré-processada: {caminho.name}")
+        _estado_worker['contadores'].avancar_progresso()
+        registro['pre_processada'] = str(caminho_destino)
+    return registro
+
+
+# Pastas de saída em que uma foto deve estar, conforme o resultado da comparação
+def pastas_destino(status: str, pessoas: Iterable[str]) -> List[str]:
+    if status == STATUS_IDENTIFICADA:
+        return sorted(pessoas)
+    if status == STATUS_DESCONHECIDA:
+        return [PASTA_DESCONHECIDOS]
+    return []
+
+
+# Coloca a foto original nas pastas indicadas, conforme MODO_COLOCACAO, com o nome de saída da foto
+def colocar_foto(caminho_original: Path, pasta_saida: Path, pastas: List[str], indice: int, total: int, nome_saida: Optional[str] = None) -> None:
+    nome_saida = nome_saida or caminho_original.name
+    if Configuracao.MODO_COLOCACAO == "indice":
+        # Os arquivos de índice são gerados do manifesto ao final da execução
+        for nome in pastas:
+            logger.info(f"[{indice}/{total}] {nome_saida} registrada em '{nome}'")
+        return
+    for nome in pastas:
+        pasta_pessoa = pasta_saida / nome
+        pasta_pessoa.mkdir(parents=True, exist_ok=True)
+        modo = colocar_arquivo(caminho_original, pasta_pessoa, Configuracao.MODO_COLOCACAO, nome_saida)
+        if modo == "copia":
+            logger.info(f"[{indice}/{total}] {nome_saida} copiada para '{nome}'")
+        else:
+            logger.info(f"[{indice}/{total}] {nome_saida} colocada em '{nome}' ({modo})")
+
+
+# Remove cópias deixadas por uma classificação anterior que não vale mais
+def remover_colocacao(caminho_original: Path, pasta_saida: Path, pastas: List[str], nome_saida: Optional[str] = None) -> None:
+    if Configuracao.MODO_COLOCACAO == "indice":
+        return
+    nome_saida = nome_saida or caminho_original.name
+    for nome in pastas:
+        (pasta_saida / nome / nome_saida).unlink(missing_ok=True)
+        logger.info(f"{nome_saida} removida de '{nome}'")
+
+
+# Lê a foto uma única vez, preenchendo tamanho, mtime e hash do resultado
+def ler_foto(caminho_imagem: Optional[Path], caminho_original: Path, resultado: dict) -> Optional[np.ndarray]:
+    tempos = resultado['tempos']
+    with medir(tempos, 'leitura'):
+        estado = caminho_original.stat()
+        resultado.update(tamanho=estado.st_size, mtime=estado.st_mtime_ns)
+        if caminho_imagem is None:
+            # Pipeline em memória: o arquivo é lido uma única vez para o hash e a decodificação
+            conteudo = caminho_original.read_bytes()
+            resultado['hash'] = calcular_hash_conteudo(conteudo)
+        else:
+            resultado['hash'] = calcular_hash_arquivo(caminho_original)
+    if caminho_imagem is not None:
+        return carregar_imagem(caminho_imagem, tempos=tempos)
+    if Configuracao.MINIATURA_EXIF_PRIMEIRO:
+        with medir(tempos, 'miniatura'):
+            sem_rostos = miniatura_sem_rostos(conteudo)
+        if sem_rostos:
+            return IMAGEM_SEM_ROSTOS
+    return carregar_imagem(caminho_original, conteudo, tempos)
+
+
+# Compara os rostos da foto com a galeria e completa o resultado
+def comparar_foto(resultado: dict, codificacoes: List[np.ndarray], areas: list) -> None:
+    with medir(resultado['tempos'], 'comparacao'):
+        resultado.update(
+            num_rostos=len(codificacoes),
+            codificacoes=np.asarray(codificacoes, dtype=np.float32),
+            areas=areas,
+        )
         if not codificacoes:
-            logger.info(f"[{indice}/{total}] Nenhum rosto em {caminho_imagem.name}")
-            contador_processadas.value += 1
-            fila_progresso.put(1)
+            resultado['status'] = STATUS_SEM_ROSTOS
             return
-        pessoas_identificadas = set()
-        for codificacao in codificacoes:
-            for nome, codificacoes_conhecidas in rostos_conhecidos.items():
-                if comparar_rostos(codificacoes_conhecidas, codificacao):
-                    pessoas_identificadas.add(nome)
+        pessoas_identificadas = _estado_worker['galeria'].identificar(codificacoes)
         if pessoas_identificadas:
-            for nome in pessoas_identificadas:
-                pasta_pessoa = pasta_saida / nome
-                pasta_pessoa.mkdir(parents=True, exist_ok=True)
-                shutil.copy(caminho_original, pasta_pessoa)
-                logger.info(f"[{indice}/{total}] {caminho_original.name} copiada para {nome}")
+            resultado.update(status=STATUS_IDENTIFICADA, pessoas=sorted(pessoas_identificadas))
         else:
-            pasta_desconhecidos = pasta_saida / "desconhecidos"
-            pasta_desconhecidos.mkdir(parents=True, exist_ok=True)
-            shutil.copy(caminho_original, pasta_desconhecidos)
-            logger.info(f"[{indice}/{total}] {caminho_original.name} copiada para 'desconhecidos'")
-        contador_processadas.value += 1
-        fila_progresso.put(1)
+            resultado['status'] = STATUS_DESCONHECIDA
+
+
+# Copia a foto para as pastas correspondentes ao resultado já comparado
+def colocar_resultado(registro: dict, pasta_saida: Path, total: int) -> None:
+    caminho_original = Path(registro['caminho'])
+    if registro['status'] == STATUS_SEM_ROSTOS:
+        logger.info(f"[{registro['indice']}/{total}] Nenhum rosto em {caminho_original.name}")
+        return
+    with medir(registro['tempos'], 'colocacao'):
+        colocar_foto(caminho_original, pasta_saida, pastas_destino(registro['status'], registro['pessoas']), registro['indice'], total, registro['nome_saida'])
+
+
+def novo_registro(caminho_original: Path, nome_saida: str, indice: int) -> dict:
+    """Registro de uma foto de entrada, que acompanha a foto por todas as etapas até o manifesto.
+
+    Leva a identidade (id estável, caminho, nome de saída, posição na descoberta), os
+    artefatos derivados (arquivo pré-processado), os tempos de cada etapa e o resultado, preenchido pelos workers;
+    assim as etapas podem reordenar o trabalho sem trocar o resultado de uma foto por outro.
+    """
+    return {
+        'id': identificador_foto(caminho_original),
+        'caminho': str(caminho_original),
+        'nome_saida': nome_saida,
+        'indice': indice,
+        'pre_processada': None,
+        'tempos': TemposFoto() if Configuracao.PERFIL_EXECUCAO else None,
+        'tamanho': 0,
+        'mtime': 0,
+        'status': STATUS_ERRO,
+        'num_rostos': 0,
+        'pessoas': [],
+    }
+
+
+# Lê uma foto e extrai seus rostos logo em seguida, para que a imagem decodificada seja descartada
+# antes da próxima; devolve recortes compactados ou, sem inferência em lote, as codificações prontas
+def analisar_foto(caminho_imagem: Optional[Path], registro: dict) -> Optional[Tuple[List[np.ndarray], list]]:
+    caminho_original = Path(registro['caminho'])
+    try:
+        imagem = ler_foto(caminho_imagem, caminho_original, registro)
+        if imagem is None:
+            logger.warning(f"[{registro['indice']}] Imagem ignorada: {caminho_original.name}")
+            return None
+        if not Configuracao.INFERENCIA_EM_LOTE:
+            # O DeepFace.represent detecta e codifica numa só chamada
+            with medir(registro['tempos'], 'representacao'):
+                return carregar_rostos(imagem)
+        rostos, areas = extrair_rostos(imagem, registro['tempos'])
+        with medir(registro['tempos'], 'recorte'):
+            return [compactar_recorte(rosto) for rosto in rostos], areas
     except (PermissionError, OSError) as e:
-        logger.error(f"Erro ao processar {caminho_imagem}: {e}")
+        logger.error(f"Erro ao ler {caminho_original}: {e}")
+    except Exception as e:
+        logger.error(f"Erro ao detectar rostos em {caminho_original}: {e}")
+    return None
+
+
+# Função independente para processamento de imagens em Pool
+def processar_lote_imagens(registros: List[dict], pasta_saida: Path, total: int) -> List[dict]:
+    """Processa um grupo de registros de fotos e os devolve com o resultado preenchido.
+
+    Cada foto é detectada logo após a decodificação e só os recortes compactados ficam na
+    memória; os recortes de todo o grupo são então codificados juntos, em lotes, antes da
+    comparação e da cópia.
+    """
+    if not aguardar_liberacao():
+        return []
+    deteccoes = []
+    for registro in registros:
+        caminho_imagem = Path(registro['pre_processada']) if registro['pre_processada'] else None
+        deteccao = analisar_foto(caminho_imagem, registro)
+        if deteccao is not None:
+            deteccoes.append((registro, *deteccao))
+
+    if Configuracao.INFERENCIA_EM_LOTE:
+        try:
+            inicio = time.perf_counter()
+            vetores = representar_rostos([rosto for _, rostos, _ in deteccoes for rosto in rostos])
+            repartir_tempo([registro['tempos'] for registro, _, _ in deteccoes], [len(rostos) for _, rostos, _ in deteccoes], 'codificacao', time.perf_counter() - inicio)
+        except Exception as e:
+            logger.error(f"Erro ao codificar lote de {len(deteccoes)} fotos: {e}")
+            _estado_worker['contadores'].contar_processadas(len(registros))
+            return registros
+        posicao = 0
+        for indice, (registro, rostos, areas) in enumerate(deteccoes):
+            deteccoes[indice] = (registro, list(vetores[posicao:posicao + len(rostos)]), areas)
+            posicao += len(rostos)
+
+    for registro, codificacoes, areas in deteccoes:
+        try:
+            comparar_foto(registro, codificacoes, areas)
+            colocar_resultado(registro, pasta_saida, total)
+        except (PermissionError, OSError) as e:
+            logger.error(f"Erro ao processar {registro['caminho']}: {e}")
+            registro['status'] = STATUS_ERRO
+    # Fotos ignoradas ou com erro também contam, como no pipeline em estágios, para o progresso chegar ao total
+    _estado_worker['contadores'].contar_processadas(len(registros))
+    return registros
+
+# Estágio de detecção: lê, decodifica, redimensiona, detecta e recorta os rostos de cada foto
+def estagio_deteccao(fila_entrada: 'multiprocessing.Queue', fila_rostos: 'multiprocessing.Queue', cancelado: 'multiprocessing.sharedctypes.Synchronized', evento_processamento: 'multiprocessing.synchronize.Event', contadores: ContadoresCompartilhados, plano_threads: Optional[Dict[str, int]]) -> None:
+    inicializar_worker(cancelado, evento_processamento, contadores, None, plano_threads, preparar_detector)
+    while True:
+        registro = fila_entrada.get()
+        if registro is None:
+            break
+        if not aguardar_liberacao():
+            continue  # Cancelado: apenas esvazia a fila até o sinal de término
+        rostos, areas = analisar_foto(None, registro) or (None, None)
+        fila_rostos.put((registro, rostos, areas))
+    logger.info(f"Worker {os.getpid()}: detecção encerrada ({obter_detector().resumo()})")
+
+
+# Estágio de codificação: agrupa recortes de várias fotos em lotes, codifica e compara com a galeria
+def estagio_codificacao(fila_rostos: 'multiprocessing.Queue', fila_resultados: 'multiprocessing.Queue', cancelado: 'multiprocessing.sharedctypes.Synchronized', evento_processamento: 'multiprocessing.synchronize.Event', contadores: ContadoresCompartilhados, descritor_galeria: dict, plano_threads: Optional[Dict[str, int]]) -> None:
+    inicializar_worker(cancelado, evento_processamento, contadores, descritor_galeria, plano_threads, preparar_reconhecimento)
+    tamanho_lote = max(1, Configuracao.TAMANHO_LOTE_INFERENCIA)
+    terminou = False
+    while not terminou:
+        pendentes = []
+        num_rostos = 0
+        item = fila_rostos.get()
+        # Junta fotos até completar um lote ou a fila ficar ociosa por ESPERA_LOTE_SEGUNDOS
+        while True:
+            if item is None:
+                terminou = True
+                break
+            pendentes.append(item)
+            num_rostos += len(item[1] or [])
+            if num_rostos >= tamanho_lote:
+                break
+            try:
+                item = fila_rostos.get(timeout=Configuracao.ESPERA_LOTE_SEGUNDOS)
+            except queue.Empty:
+                break
+        if not pendentes or not aguardar_liberacao():
+            continue
+        validas = [p for p in pendentes if p[1] is not None]
+        try:
+            inicio = time.perf_counter()
+            vetores = representar_rostos([rosto for _, rostos, _ in validas for rosto in rostos])
+            repartir_tempo([registro['tempos'] for registro, _, _ in validas], [len(rostos) for _, rostos, _ in validas], 'codificacao', time.perf_counter() - inicio)
+            posicao = 0
+            for registro, rostos, areas in validas:
+                comparar_foto(registro, list(vetores[posicao:posicao + len(rostos)]), areas)
+                posicao += len(rostos)
+        except Exception as e:
+            logger.error(f"Erro ao codificar lote de {len(validas)} fotos: {e}")
+            for registro, _, _ in validas:
+                registro['status'] = STATUS_ERRO
+        for registro, _, _ in pendentes:
+            fila_resultados.put(registro)
+
 
 class SeparadorFotos:
     def __init__(self):
-        self.gerenciador = Manager()
-        self.cancelado = self.gerenciador.Value('b', False)
-        self.fila_progresso = self.gerenciador.Queue()
-        self.fila_logs = self.gerenciador.Queue()
-        self.evento_processamento = self.gerenciador.Event()
+        # Cancelamento e pausa usam primitivas nativas, herdadas pelos workers via inicializador do Pool
+        self.cancelado = multiprocessing.Value('b', False)
+        # Logs chegam à interface em lotes de linhas já formatadas, por uma fila nativa
+        self.fila_logs = multiprocessing.Queue()
+        self.evento_processamento = multiprocessing.Event()
         self.evento_processamento.set()
-        self.contador_processadas = self.gerenciador.Value('i', 0)  # Contador compartilhado
+        # Progresso e fotos concluídas ficam em memória compartilhada, uma vaga por processo ou thread
+        self.contadores = ContadoresCompartilhados()
+        self.fila_progresso = FilaProgresso(self.contadores)
+        self.contador_processadas = ContadorProcessadas(self.contadores)
+        self.total_imagens = 0  # Cresce enquanto a pasta de entrada é percorrida
+        self.perfil = PerfilExecucao()
 
         # Configurar logging
         manipulador = logging.StreamHandler()
         manipulador.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
-        logging.getLogger().handlers = [manipulador, QueueHandler(self.fila_logs)]
+        logging.getLogger().handlers = [manipulador, ManipuladorLogsEmLote(
+            self.fila_logs,
+            Configuracao.INTERVALO_ENVIO_LOGS,
+            Configuracao.LINHAS_POR_LOTE_LOG,
+            Configuracao.LOGS_INFO_POR_SEGUNDO,
+        )]
         logging.getLogger().setLevel(logging.INFO)
 
-    def obter_fila_logs(self) -> Queue:
-        """Retorna a fila de logs para a interface."""
+    def obter_fila_logs(self) -> 'multiprocessing.Queue':
+        """Retorna a fila de logs para a interface; cada item é um texto ou uma lista de linhas."""
         return self.fila_logs
 
-    def obter_fila_progresso(self) -> Queue:
-        """Retorna a fila de progresso para a interface."""
+    def obter_fila_progresso(self) -> FilaProgresso:
+        """Retorna a fila de progresso para a interface; cada leitura traz o avanço acumulado desde a anterior."""
         return self.fila_progresso
 
-    def obter_contador_processadas(self):
+    def obter_contador_processadas(self) -> ContadorProcessadas:
         """Retorna o contador de imagens processadas."""
         return self.contador_processadas
 
+    def obter_total_imagens(self) -> int:
+        """Retorna quantas imagens de entrada já foram encontradas nesta execução."""
+        return self.total_imagens
+
     def pausar_processamento(self) -> None:
         self.evento_processamento.clear()
         logger.info("Processamento pausado")
@@ -112,35 +451,55 @@ class SeparadorFotos:
         logger.info("Processamento cancelado")
         self.fila_logs.put("Processamento cancelado.")
 
-    def pre_processar_imagens_em_lote(self, arquivos: List[Path], diretorio_temp: Path) -> List[Path]:
-        total = len(arquivos)
-        logger.info(f"Iniciando pré-processamento de {total} imagens")
-        caminhos_pre_processados = []
-        lote_tamanho = 10  # Ajustar conforme memória disponível
-        
-        # Determinar número de processos com base nos núcleos
-        num_nucleos = cpu_count()
-        if num_nucleos <= 2:
-            num_processos = 1
-        else:
-            num_processos = max(1, math.floor(num_nucleos * 0.8))
-        
-        logger.info(f"Usando {num_processos} processos para {num_nucleos} núcleos")
-        
-        for i in range(0, total, lote_tamanho):
-            if self.cancelado.value:
-                return caminhos_pre_processados
-            lote = arquivos[i:i + lote_tamanho]
-            with Pool(processes=num_processos) as pool:
-                resultados = pool.starmap(
-                    processar_imagem_pre,
-                    [(caminho, diretorio_temp, i + j + 1, total, self.cancelado, self.fila_progresso)
-                     for j, caminho in enumerate(lote)]
-                )
-            caminhos_pre_processados.extend([r for r in resultados if r is not None])
-        
-        logger.info(f"Pré-processamento concluído: {len(caminhos_pre_processados)}/{total} imagens válidas")
-        return caminhos_pre_processados
+    def executar_em_fluxo(self, pool: Pool, funcao: Callable, argumentos: Iterable[tuple], num_processos: int) -> Iterator[Any]:
+        """Envia tarefas ao Pool via imap_unordered mantendo um número limitado de tarefas em voo.
+
+        Enquanto pausado, nenhuma tarefa nova é enviada. Ao cancelar, apenas as pendentes são aguardadas.
+        """
+        chunksize = max(1, Configuracao.TAMANHO_CHUNK)
+        # A janela precisa comportar ao menos um chunk completo para o alimentador não travar
+        janela = threading.BoundedSemaphore(num_processos * max(Configuracao.TAREFAS_EM_VOO_POR_PROCESSO, chunksize))
+
+        def alimentar() -> Iterator[Tuple[Callable, tuple]]:
+            for args in argumentos:
+                self.evento_processamento.wait()
+                while not janela.acquire(timeout=0.1):
+                    if self.cancelado.value:
+                        return
+                if self.cancelado.value:
+                    janela.release()
+                    return
+                yield funcao, args
+
+        for resultado in pool.imap_unordered(executar_tarefa, alimentar(), chunksize=chunksize):
+            janela.release()
+            yield resultado
+
+    def pre_processar_imagens_em_lote(self, registros: List[dict], diretorio_temp: Path, pool: Pool, num_processos: int) -> List[dict]:
+        """Pré-processa as imagens no Pool e retorna os registros, com 'pre_processada' preenchido nos válidos."""
+        total = len(registros)
+        logger.info(f"Iniciando pré-processamento de {total} imagens com {num_processos} processos")
+        argumentos = ((registro, diretorio_temp, self.total_imagens) for registro in registros)
+        registros = list(self.executar_em_fluxo(pool, processar_imagem_pre, argumentos, num_processos))
+        validos = sum(1 for registro in registros if registro['pre_processada'])
+        logger.info(f"Pré-processamento concluído: {validos}/{total} imagens válidas")
+        return registros
+
+    def codificar_referencias(self, caminhos: List[Path], diretorio_temp: Path) -> List[Optional[List[np.ndarray]]]:
+        """Codifica as imagens de referência em um Pool, na ordem recebida.
+
+        O TensorFlow nunca é iniciado no processo principal: cada worker aplica o próprio
+        limite de threads, e os processos do reconhecimento, criados depois, também podem.
+        """
+        if not caminhos:
+            return []
+        num_processos = min(calcular_num_processos(), len(caminhos))
+        logger.info(f"Codificando {len(caminhos)} imagens de referência com {num_processos} processos")
+        with Pool(processes=num_processos, initializer=inicializar_worker, initargs=(self.cancelado, self.evento_processamento, self.contadores, None, planejar_threads(num_processos))) as pool:
+            codificacoes = pool.starmap(codificar_imagem, [(caminho, diretorio_temp / f"ref_{caminho.name}") for caminho in caminhos])
+            pool.close()
+            pool.join()
+        return codificacoes
 
     def gerar_relatorio(self, pasta_saida: Path, erros: List[str], imagens_sem_rostos: List[Path] = None) -> None:
         relatorio = {}
@@ -148,6 +507,9 @@ class SeparadorFotos:
             for pasta in pasta_saida.iterdir():
                 if pasta.is_dir():
                     qtd_fotos = len([f for f in pasta.iterdir() if f.suffix.lower() in {'.jpg', '.jpeg', '.png'}])
+                    arquivo_indice = pasta / ARQUIVO_INDICE
+                    if arquivo_indice.exists():
+                        qtd_fotos += sum(1 for linha in arquivo_indice.open(encoding='utf-8') if linha.strip())
                     relatorio[pasta.name] = qtd_fotos
             relatorio_path = pasta_saida / "relatorio.txt"
             with relatorio_path.open("w", encoding='utf-8') as f:
@@ -168,9 +530,381 @@ class SeparadorFotos:
             logger.error(f"Erro ao gerar relatório: {e}")
             erros.append(f"Erro ao gerar relatório: {e}")
 
-    def separar_fotos(self, pasta_referencia: str, pasta_entrada: str, pasta_saida: str) -> None:
+    def gerar_indices(self, pasta_saida: Path, manifesto: ManifestoExecucao) -> None:
+        """Escreve, em cada pasta de pessoa, o ARQUIVO_INDICE com os caminhos das fotos classificadas nela."""
+        indices: Dict[str, List[str]] = {}
+        for caminho, status, pessoas in manifesto.listar_classificacoes():
+            for nome in pastas_destino(status, pessoas):
+                indices.setdefault(nome, []).append(caminho)
+        try:
+            for nome, caminhos in indices.items():
+                pasta_pessoa = pasta_saida / nome
+                pasta_pessoa.mkdir(parents=True, exist_ok=True)
+                arquivo_temp = pasta_pessoa / f"{ARQUIVO_INDICE}.tmp"
+                arquivo_temp.write_text("".join(f"{c}\n" for c in sorted(caminhos)), encoding='utf-8')
+                os.replace(arquivo_temp, pasta_pessoa / ARQUIVO_INDICE)
+            logger.info(f"Índices de fotos gravados para {len(indices)} pastas")
+        except (PermissionError, OSError) as e:
+            logger.error(f"Erro ao gravar índices de fotos: {e}")
+
+    def descobrir_fotos(self, fontes: Iterable[Path], estado_anterior: Dict[str, dict], assinatura_galeria: str, candidatas: List[dict], nomes: RegistroNomesSaida) -> Iterator[dict]:
+        """Classifica cada foto assim que é encontrada e devolve os registros das que precisam de reconhecimento.
+
+        As inalteradas com a mesma galeria contam direto no progresso; as inalteradas com outra
+        galeria vão para `candidatas`, a serem reclassificadas pelas codificações guardadas.
+        """
+        inalteradas = 0
+        inicio = time.perf_counter()
+        for caminho in fontes:
+            # Só o tempo de percorrer a pasta: o consumo da foto acontece fora deste gerador
+            self.perfil.registrar('descoberta', time.perf_counter() - inicio)
+            self.total_imagens += 1
+            estado = estado_anterior.get(str(caminho))
+            if not ManifestoExecucao.arquivo_inalterado(estado, caminho):
+                yield novo_registro(caminho, nomes.nome_saida(caminho), self.total_imagens)
+            elif estado['assinatura_galeria'] == assinatura_galeria:
+                inalteradas += 1
+                self.contadores.contar_processadas()
+            else:
+                candidatas.append(novo_registro(caminho, nomes.nome_saida(caminho), self.total_imagens))
+            inicio = time.perf_counter()
+        if inalteradas:
+            logger.info(f"{inalteradas} fotos inalteradas desde a última execução foram ignoradas")
+
+    def calcular_perceptual(self, caminho: Path) -> Tuple[Optional[int], Optional[float]]:
+        with self.perfil.medir('hash_perceptual'):
+            return calcular_hash_perceptual(caminho), horario_captura(caminho)
+
+    def antecipar_perceptuais(self, registros: Iterable[dict]) -> Iterator[Tuple[dict, Tuple[Optional[int], Optional[float]]]]:
+        """Acompanha cada registro do seu hash perceptual e horário de captura, calculados em threads algumas fotos à frente.
+
+        A decodificação reduzida do Pillow libera o GIL, então as threads rodam em paralelo
+        enquanto o agrupamento segue na ordem da descoberta.
+        """
+        if not Configuracao.DEDUPLICAR_SEMELHANTES:
+            for registro in registros:
+                yield registro, (None, None)
+            return
+        num_threads = max(1, Configuracao.THREADS_DEDUPLICACAO)
+        with ThreadPoolExecutor(max_workers=num_threads) as calculadores:
+            janela = deque()
+            for registro in registros:
+                janela.append((registro, calculadores.submit(self.calcular_perceptual, Path(registro['caminho']))))
+                if len(janela) > 2 * num_threads:
+                    anterior, futuro = janela.popleft()
+                    yield anterior, futuro.result()
+            while janela:
+                anterior, futuro = janela.popleft()
+                yield anterior, futuro.result()
+
+    def deduplicar(self, registros: Iterable[dict], agrupador: AgrupadorDuplicatas, estado_anterior: Dict[str, dict], candidatas: List[dict], hashes_armazenados: set) -> Iterator[dict]:
+        """Deixa passar só a primeira foto de cada grupo de duplicatas.
+
+        Uma foto com o mesmo conteúdo de outra já codificada em execução anterior vai para
+        `candidatas`, para ser só comparada com a galeria a partir das codificações guardadas.
+        """
+        tamanhos_armazenados = {e['tamanho'] for e in estado_anterior.values() if e['hash'] in hashes_armazenados}
+        for registro, (perceptual, captura) in self.antecipar_perceptuais(registros):
+            caminho = Path(registro['caminho'])
+            inicio = time.perf_counter()
+            try:
+                estado = caminho.stat()
+                if estado.st_size in tamanhos_armazenados:
+                    hash_conteudo = agrupador.hash_conteudo(caminho)
+                    if hash_conteudo in hashes_armazenados:
+                        anterior = estado_anterior.get(str(caminho), {'status': STATUS_ERRO, 'pessoas': [], 'assinatura_galeria': ''})
+                        estado_anterior[str(caminho)] = {**anterior, 'tamanho': estado.st_size, 'mtime': estado.st_mtime_ns, 'hash': hash_conteudo}
+                        candidatas.append(registro)
+                        continue
+                if agrupador.agrupar(caminho, estado.st_size, estado.st_mtime_ns, registro['nome_saida'], perceptual, captura) is not None:
+                    continue
+            except OSError as e:
+                logger.warning(f"Erro ao verificar duplicatas de {caminho}: {e}")
+            finally:
+                self.perfil.registrar('deduplicacao', time.perf_counter() - inicio)
+            yield registro
+
+    def aplicar_duplicatas(self, agrupador: AgrupadorDuplicatas, pasta_saida: Path, manifesto: ManifestoExecucao, assinatura_galeria: str, erros: List[str]) -> None:
+        """Copia para cada duplicata o resultado já registrado para o representante do seu grupo.
+
+        Uma foto semelhante recebe o próprio hash de conteúdo e uma cópia das codificações do
+        representante, para que uma reclassificação posterior a alcance como qualquer outra foto.
+        """
+        if not agrupador.membros:
+            return
+        contagem = agrupador.contar()
+        logger.info(f"Aplicando resultados a {contagem['exata']} duplicatas exatas e {contagem['semelhante']} fotos semelhantes")
+        manifesto.confirmar()
+        estados = manifesto.carregar_estado()
+        total = sum(len(membros) for membros in agrupador.membros.values())
+        indice = 0
+        for representante, membros in agrupador.membros.items():
+            base = estados.get(representante)
+            if base is None or base['assinatura_galeria'] != assinatura_galeria:
+                continue  # Representante não processado (cancelado): o grupo volta na próxima execução
+            for membro in membros:
+                self.evento_processamento.wait()
+                if self.cancelado.value:
+                    manifesto.confirmar()
+                    return
+                indice += 1
+                anterior = estados.get(membro['caminho'])
+                anteriores = pastas_destino(anterior['status'], anterior['pessoas']) if anterior else []
+                novas = pastas_destino(base['status'], base['pessoas'])
+                status = base['status']
+                caminho = Path(membro['caminho'])
+                tempos = TemposFoto() if Configuracao.PERFIL_EXECUCAO else None
+                try:
+                    if membro['hash'] is None:
+                        with medir(tempos, 'leitura'):
+                            membro['hash'] = agrupador.hash_conteudo(caminho)
+                    if base['hash']:
+                        manifesto.copiar_codificacoes(base['hash'], membro['hash'])
+                    with medir(tempos, 'colocacao'):
+                        remover_colocacao(caminho, pasta_saida, [p for p in anteriores if p not in novas], membro['nome_saida'])
+                        colocar_foto(caminho, pasta_saida, [p for p in novas if p not in anteriores], indice, total, membro['nome_saida'])
+                except (PermissionError, OSError) as e:
+                    logger.error(f"Erro ao colocar duplicata {caminho}: {e}")
+                    erros.append(f"Erro ao colocar duplicata {caminho.name}: {e}")
+                    status = STATUS_ERRO
+                self.registrar_foto(manifesto, {
+                    'caminho': membro['caminho'],
+                    'nome_saida': membro['nome_saida'],
+                    'tamanho': membro['tamanho'],
+                    'mtime': membro['mtime'],
+                    'hash': membro['hash'],
+                    'status': status,
+                    'num_rostos': base['num_rostos'],
+                    'pessoas': base['pessoas'],
+                    'tempos': tempos,
+                }, assinatura_galeria)
+                self.contadores.contar_processadas()
+        manifesto.confirmar()
+
+    def reclassificar_armazenadas(self, registros: List[dict], estado_anterior: Dict[str, dict], codificacoes: Dict[str, np.ndarray], pasta_saida: Path, galeria: GaleriaRostos, manifesto: ManifestoExecucao, assinatura_galeria: str, erros: List[str]) -> None:
+        """Compara as codificações guardadas com a galeria atual e ajusta as cópias que mudaram."""
+        total = len(registros)
+        logger.info(f"Reclassificando {total} fotos a partir das codificações armazenadas")
+        for indice, registro in enumerate(registros, start=1):
+            self.evento_processamento.wait()
+            if self.cancelado.value:
+                break
+            caminho = Path(registro['caminho'])
+            estado = estado_anterior[registro['caminho']]
+            tempos = registro['tempos']
+            vetores = codificacoes[estado['hash']]
+            with medir(tempos, 'comparacao'):
+                pessoas = galeria.identificar(vetores) if len(vetores) else set()
+            if len(vetores) == 0:
+                status = STATUS_SEM_ROSTOS
+            else:
+                status = STATUS_IDENTIFICADA if pessoas else STATUS_DESCONHECIDA
+            anteriores = pastas_destino(estado['status'], estado['pessoas'])
+            novas = pastas_destino(status, pessoas)
+            try:
+                with medir(tempos, 'colocacao'):
+                    remover_colocacao(caminho, pasta_saida, [p for p in anteriores if p not in novas], registro['nome_saida'])
+                    colocar_foto(caminho, pasta_saida, [p for p in novas if p not in anteriores], indice, total, registro['nome_saida'])
+            except (PermissionError, OSError) as e:
+                logger.error(f"Erro ao reclassificar {caminho}: {e}")
+                erros.append(f"Erro ao reclassificar {caminho.name}: {e}")
+                status = STATUS_ERRO
+            self.registrar_foto(manifesto, {
+                'caminho': registro['caminho'],
+                'nome_saida': registro['nome_saida'],
+                'tamanho': estado['tamanho'],
+                'mtime': estado['mtime'],
+                'hash': estado['hash'],
+                'status': status,
+                'num_rostos': len(vetores),
+                'pessoas': sorted(pessoas),
+                'tempos': tempos,
+            }, assinatura_galeria)
+            self.contadores.contar_processadas()
+        manifesto.confirmar()
+
+    def executar_pipeline_estagios(self, registros: Iterable[dict], pasta_saida: Path, descritor_galeria: dict, manifesto: ManifestoExecucao, assinatura_galeria: str) -> None:
+        """Executa detecção e codificação em grupos de processos separados, ligados por filas limitadas.
+
+        Os processos de detecção leem, decodificam, detectam e recortam os rostos; os de codificação
+        juntam recortes de várias fotos em lotes para o modelo e comparam com a galeria. A cópia das
+        fotos roda em threads do processo principal, que também registra o manifesto.
+        """
+        num_codificacao, num_deteccao = calcular_processos_estagios()
+        logger.info(f"Pipeline em estágios: {num_deteccao} processos de detecção, {num_codificacao} de codificação")
+        self.fila_logs.put(f"Processando fotos ({num_deteccao} detecção + {num_codificacao} codificação)...")
+
+        plano_threads = planejar_threads_execucao()
+        if plano_threads:
+            logger.info(f"Threads por processo: {plano_threads}")
+        tamanho_fila = max(1, Configuracao.TAMANHO_FILA_ESTAGIO)
+        fila_entrada = multiprocessing.Queue(maxsize=tamanho_fila)
+        fila_rostos = multiprocessing.Queue(maxsize=tamanho_fila)
+        fila_resultados = multiprocessing.Queue()
+        detectores = [
+            multiprocessing.Process(target=estagio_deteccao, args=(fila_entrada, fila_rostos, self.cancelado, self.evento_processamento, self.contadores, plano_threads), daemon=True)
+            for _ in range(num_deteccao)
+        ]
+        codificadores = [
+            multiprocessing.Process(target=estagio_codificacao, args=(fila_rostos, fila_resultados, self.cancelado, self.evento_processamento, self.contadores, descritor_galeria, plano_threads), daemon=True)
+            for _ in range(num_codificacao)
+        ]
+        for processo in detectores + codificadores:
+            processo.start()
+
+        def alimentar() -> None:
+            try:
+                # As fotos podem ainda estar sendo descobertas: cada uma entra no pipeline assim que é encontrada
+                for registro in registros:
+                    self.evento_processamento.wait()
+                    if self.cancelado.value:
+                        break
+                    fila_entrada.put(registro)
+            except Exception as e:
+                logger.error(f"Erro ao percorrer as fotos de entrada: {e}")
+            finally:
+                for _ in detectores:
+                    fila_entrada.put(None)
+
+        def encerrar_estagios() -> None:
+            # Cada estágio só recebe o sinal de término quando o anterior terminou por completo
+            for processo in detectores:
+                processo.join()
+            for _ in codificadores:
+                fila_rostos.put(None)
+            for processo in codificadores:
+                processo.join()
+            fila_resultados.put(None)
+
+        threading.Thread(target=alimentar, daemon=True).start()
+        encerramento = threading.Thread(target=encerrar_estagios, daemon=True)
+        encerramento.start()
+
+        def registrar(registro: dict) -> None:
+            self.registrar_foto(manifesto, registro, assinatura_galeria)
+            self.contadores.contar_processadas()
+
+        pendentes = []
+        terminou = False
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, Configuracao.THREADS_COLOCACAO)) as colocadores:
+                while True:
+                    registro = fila_resultados.get()
+                    if registro is None:
+                        terminou = True
+                        break
+                    if registro['status'] in (STATUS_IDENTIFICADA, STATUS_DESCONHECIDA, STATUS_SEM_ROSTOS):
+                        pendentes.append((colocadores.submit(colocar_resultado, registro, pasta_saida, self.total_imagens), registro))
+                    else:
+                        registrar(registro)
+                    # O SQLite é usado só nesta thread: registra as fotos cujas cópias já terminaram
+                    em_andamento = []
+                    for futuro, registro_colocado in pendentes:
+                        if futuro.done():
+                            self._concluir_colocacao(futuro, registro_colocado, registrar)
+                        else:
+                            em_andamento.append((futuro, registro_colocado))
+                    pendentes = em_andamento
+                for futuro, registro_colocado in pendentes:
+                    self._concluir_colocacao(futuro, registro_colocado, registrar)
+        finally:
+            if not terminou:
+                # Falha no processo principal (por exemplo, do SQLite): os estágios não podem seguir lendo a
+                # entrada nem a galeria, que some com o diretório temporário. Cancelados, eles só esvaziam as
+                # filas e encerram; os resultados restantes são descartados até o sinal de término.
+                self.cancelado.value = True
+                self.evento_processamento.set()
+                while fila_resultados.get() is not None:
+                    pass
+            encerramento.join()
+
+    @staticmethod
+    def _concluir_colocacao(futuro, resultado: dict, registrar: Callable[[dict], None]) -> None:
+        try:
+            futuro.result()
+        except Exception as e:
+            logger.error(f"Erro ao copiar {resultado['caminho']}: {e}")
+            resultado['status'] = STATUS_ERRO
+        registrar(resultado)
+
+    def registrar_foto(self, manifesto: ManifestoExecucao, registro: dict, assinatura_galeria: str) -> None:
+        """Grava o resultado da foto no manifesto e soma os tempos medidos para ela ao perfil da execução."""
+        with self.perfil.medir('registro'):
+            manifesto.registrar(registro, assinatura_galeria)
+        self.perfil.adicionar_foto(registro.get('tempos'), registro.get('num_rostos', 0))
+
+    def gerar_perfil(self, pasta_saida: Path) -> None:
+        """Grava ARQUIVO_PERFIL com os tempos por etapa e por processo, as taxas e a configuração usada."""
+        configuracao = {nome: valor for nome, valor in vars(Configuracao).items() if nome.isupper()}
+        self.perfil.salvar(pasta_saida / ARQUIVO_PERFIL, {
+            'imagens_encontradas': self.total_imagens,
+            'cancelado': bool(self.cancelado.value),
+            'configuracao': configuracao,
+        })
+
+    def reconhecer_fotos(self, registros: Iterable[dict], pasta_saida: Path, diretorio_temp: Path, galeria: GaleriaRostos, manifesto: ManifestoExecucao, assinatura_galeria: str, erros: List[str]) -> None:
+        """Executa o reconhecimento no Pool e registra o resultado de cada foto no manifesto.
+
+        As fotos podem vir de um gerador ainda percorrendo a pasta; só o pré-processamento em
+        disco precisa da lista completa antes de começar.
+        """
+        num_nucleos = cpu_count()
+        num_processos = calcular_num_processos()
+        try:
+            descritor_galeria = galeria.publicar(diretorio_temp / "galeria.npy")
+            if pipeline_estagios_ativo():
+                self.executar_pipeline_estagios(registros, pasta_saida, descritor_galeria, manifesto, assinatura_galeria)
+                return
+            # Um único Pool para toda a execução: os modelos são carregados uma vez por processo
+            plano_threads = planejar_threads_execucao()
+            if plano_threads:
+                logger.info(f"Threads por processo: {plano_threads}")
+            with Pool(processes=num_processos, initializer=inicializar_worker, initargs=(self.cancelado, self.evento_processamento, self.contadores, descritor_galeria, plano_threads)) as pool:
+                if not Configuracao.PIPELINE_EM_MEMORIA:
+                    registros = self.pre_processar_imagens_em_lote(list(registros), diretorio_temp, pool, num_processos)
+                    # As que falharam no pré-processamento ficam registradas com erro, para nova tentativa
+                    for registro in registros:
+                        if not registro['pre_processada']:
+                            self.registrar_foto(manifesto, registro, assinatura_galeria)
+                            self.contadores.contar_processadas()
+                    registros = [registro for registro in registros if registro['pre_processada']]
+                    if not registros:
+                        erros.append("Nenhuma imagem válida após pré-processamento")
+                        logger.warning("Nenhuma imagem válida após pré-processamento")
+                        pool.close()
+                        pool.join()
+                        return
+
+                logger.info(f"Usando {num_processos}/{num_nucleos} núcleos")
+                self.fila_logs.put(f"Processando fotos com {num_processos} núcleos...")
+                # O total enviado a cada grupo é o conhecido no momento em que ele sai para o Pool
+                argumentos = (
+                    (grupo, pasta_saida, self.total_imagens)
+                    for grupo in agrupar(registros, max(1, Configuracao.FOTOS_POR_TAREFA))
+                )
+                for processados in self.executar_em_fluxo(pool, processar_lote_imagens, argumentos, num_processos):
+                    for registro in processados:
+                        self.registrar_foto(manifesto, registro, assinatura_galeria)
+                # Encerra os workers normalmente: o terminate() na saída do with descartaria o último lote de logs de cada um
+                pool.close()
+                pool.join()
+        except sqlite3.Error as e:
+            erros.append(f"Erro ao gravar manifesto de execução: {e}")
+            logger.error(f"Erro ao gravar manifesto de execução: {e}")
+        except Exception as e:
+            erros.append(f"Erro no processamento paralelo: {e}")
+            logger.error(f"Erro no processamento paralelo: {e}")
+
+    def reclassificar_fotos(self, pasta_referencia: str, pasta_entrada: str, pasta_saida: str) -> None:
+        """Refaz só a comparação e a cópia usando as codificações guardadas no manifesto, sem detectar rostos."""
+        self.separar_fotos(pasta_referencia, pasta_entrada, pasta_saida, somente_reclassificar=True)
+
+    def separar_fotos(self, pasta_referencia: str, pasta_entrada: str, pasta_saida: str, somente_reclassificar: bool = False) -> None:
         self.cancelado.value = False
-        self.contador_processadas.value = 0
+        self.evento_processamento.set()
+        self.contadores.zerar()
+        self.total_imagens = 0
+        self.perfil = PerfilExecucao()
         erros = []
         imagens_sem_rostos = []  # Nova lista
         pasta_referencia = Path(normalizar_caminho(pasta_referencia))
@@ -187,17 +921,26 @@ class SeparadorFotos:
             logger.error(f"Erro ao criar pastas: {e}")
             self.gerar_relatorio(pasta_saida, erros, imagens_sem_rostos)
             return
+        if Configuracao.MODO_COLOCACAO not in MODOS_COLOCACAO:
+            erros.append(f"Modo de colocação inválido: '{Configuracao.MODO_COLOCACAO}' (use {', '.join(MODOS_COLOCACAO)})")
+            logger.error(f"Modo de colocação inválido: {Configuracao.MODO_COLOCACAO}")
+            self.gerar_relatorio(pasta_saida, erros, imagens_sem_rostos)
+            return
+        reiniciar_modos_colocacao()
 
         with diretorio_temporario() as diretorio_temp:
-            rostos_conhecidos = carregar_rostos_conhecidos(pasta_referencia, arquivo_json, diretorio_temp)
+            def codificar(caminhos: List[Path]) -> List[Optional[List[np.ndarray]]]:
+                return self.codificar_referencias(caminhos, diretorio_temp)
+
+            rostos_conhecidos = carregar_rostos_conhecidos(pasta_referencia, arquivo_json, diretorio_temp, codificar)
             imagens_referencia = {}
+            codificacoes_por_imagem = {}
             if not rostos_conhecidos:
                 logger.info(f"Verificando imagens de referência em {pasta_referencia}")
-                for arquivo_ref in pasta_referencia.glob("*.jpg") or pasta_referencia.glob("*.jpeg") or pasta_referencia.glob("*.png"):
-                    logger.info(f"Imagem '{arquivo_ref.name}' está sendo verificada.")
-                    caminho_temp = diretorio_temp / f"ref_{arquivo_ref.name}"
-                    if pre_processar_imagem(arquivo_ref, caminho_temp):
-                        codificacoes = carregar_codificacoes_rostos(caminho_temp)
+                arquivos_ref = list(pasta_referencia.glob("*.jpg") or pasta_referencia.glob("*.jpeg") or pasta_referencia.glob("*.png"))
+                for arquivo_ref, codificacoes in zip(arquivos_ref, codificar(arquivos_ref)):
+                    if codificacoes is not None:
+                        codificacoes_por_imagem[arquivo_ref] = codificacoes
                         if codificacoes:
                             nome_base = arquivo_ref.stem.split('_')[0]
                             rostos_conhecidos.setdefault(nome_base, []).extend(codificacoes)
@@ -209,44 +952,77 @@ class SeparadorFotos:
                     else:
                         logger.warning(f"Imagem '{arquivo_ref.name}' não pôde ser pré-processada.")
                 if rostos_conhecidos:
-                    salvar_rostos_conhecidos(rostos_conhecidos, pasta_referencia, arquivo_json, imagens_referencia)
+                    salvar_rostos_conhecidos(rostos_conhecidos, pasta_referencia, arquivo_json, imagens_referencia, codificacoes_por_imagem)
                 else:
                     logger.warning("Nenhum rosto conhecido encontrado")
                     erros.append("Nenhum rosto conhecido válido encontrado")
 
-            arquivos_imagem = listar_imagens(pasta_entrada)
-            if not arquivos_imagem:
-                erros.append("Nenhuma imagem válida na pasta de entrada")
-                logger.warning("Nenhuma imagem válida encontrada")
+            galeria = GaleriaRostos(rostos_conhecidos)
+            galeria.preparar_indice(arquivo_json.with_suffix('.ivf.npz'))
+            assinatura_galeria = galeria.assinatura()
+            try:
+                manifesto = ManifestoExecucao(pasta_saida / ARQUIVO_MANIFESTO, f"{Configuracao.MODELO}/{identificador_detector()}")
+            except sqlite3.Error as e:
+                erros.append(f"Erro ao abrir manifesto de execução: {e}")
+                logger.error(f"Erro ao abrir manifesto de execução: {e}")
                 self.gerar_relatorio(pasta_saida, erros, imagens_sem_rostos)
                 return
 
-            arquivos_pre_processados = self.pre_processar_imagens_em_lote(arquivos_imagem, diretorio_temp)
-            if not arquivos_pre_processados:
-                erros.append("Nenhuma imagem válida após pré-processamento")
-                logger.warning("Nenhuma imagem válida após pré-processamento")
-                self.gerar_relatorio(pasta_saida, erros, imagens_sem_rostos)
-                return
+            with manifesto:
+                estado_anterior = manifesto.carregar_estado()
+                if Configuracao.DESCOBERTA_EM_FLUXO:
+                    # Sem LISTAGEM_RAPIDA cada foto é validada por inteiro à medida que é encontrada
+                    fontes = varrer_imagens(pasta_entrada, not Configuracao.LISTAGEM_RAPIDA)
+                else:
+                    fontes = listar_imagens(pasta_entrada)
+                candidatas = []
+                nomes = RegistroNomesSaida({caminho: estado['nome_saida'] for caminho, estado in estado_anterior.items()})
+                novas = self.descobrir_fotos(fontes, estado_anterior, assinatura_galeria, candidatas, nomes)
+                agrupador = None
+                if Configuracao.DEDUPLICAR_FOTOS and not somente_reclassificar:
+                    agrupador = AgrupadorDuplicatas(calcular_hash_arquivo, Configuracao.DISTANCIA_MAXIMA_SEMELHANTES, Configuracao.JANELA_RAJADA_SEGUNDOS)
+                    novas = self.deduplicar(novas, agrupador, estado_anterior, candidatas, manifesto.hashes_codificados())
+                pendentes = []
+                if somente_reclassificar:
+                    ignoradas = sum(1 for _ in novas)
+                    if ignoradas:
+                        logger.info(f"{ignoradas} fotos novas ou alteradas ignoradas no modo de reclassificação")
+                elif Configuracao.DESCOBERTA_EM_FLUXO:
+                    # O reconhecimento começa enquanto a pasta ainda está sendo percorrida
+                    self.reconhecer_fotos(novas, pasta_saida, diretorio_temp, galeria, manifesto, assinatura_galeria, erros)
+                else:
+                    pendentes = list(novas)
 
-            total_fotos = len(arquivos_pre_processados)
-            num_nucleos = cpu_count()
-            num_processos = max(1, math.floor(num_nucleos * 0.8))
-            logger.info(f"Usando {num_processos}/{num_nucleos} núcleos para {total_fotos} fotos")
-            self.fila_logs.put(f"Processando {total_fotos} fotos com {num_processos} núcleos...")
-            argumentos = [
-                (caminho, rostos_conhecidos, pasta_saida, i + 1, total_fotos, arquivos_imagem[i], self.cancelado, self.fila_progresso, self.evento_processamento, self.contador_processadas)
-                for i, caminho in enumerate(arquivos_pre_processados)
-            ]
-            try:
-                with Pool(processes=num_processos) as pool:
-                    pool.starmap(processar_imagem, argumentos)
-            except Exception as e:
-                erros.append(f"Erro no processamento paralelo: {e}")
-                logger.error(f"Erro no processamento paralelo: {e}")
+                if self.total_imagens == 0:
+                    erros.append("Nenhuma imagem válida na pasta de entrada")
+                    logger.warning("Nenhuma imagem válida encontrada")
+                    self.gerar_relatorio(pasta_saida, erros, imagens_sem_rostos)
+                    return
+                logger.info(f"Encontradas {self.total_imagens} imagens em {pasta_entrada}")
+
+                # Fotos inalteradas com codificações guardadas só precisam de uma nova comparação
+                armazenadas = manifesto.carregar_codificacoes(estado_anterior[c['caminho']]['hash'] for c in candidatas)
+                reclassificar = [c for c in candidatas if estado_anterior[c['caminho']]['hash'] in armazenadas]
+                pendentes.extend(c for c in candidatas if estado_anterior[c['caminho']]['hash'] not in armazenadas)
+
+                if reclassificar and not self.cancelado.value:
+                    self.reclassificar_armazenadas(reclassificar, estado_anterior, armazenadas, pasta_saida, galeria, manifesto, assinatura_galeria, erros)
+                if somente_reclassificar:
+                    if pendentes:
+                        logger.info(f"{len(pendentes)} fotos sem codificações guardadas ignoradas no modo de reclassificação")
+                elif pendentes and not self.cancelado.value:
+                    self.reconhecer_fotos(pendentes, pasta_saida, diretorio_temp, galeria, manifesto, assinatura_galeria, erros)
+                if agrupador is not None and not self.cancelado.value:
+                    self.aplicar_duplicatas(agrupador, pasta_saida, manifesto, assinatura_galeria, erros)
+                if Configuracao.MODO_COLOCACAO == "indice":
+                    manifesto.confirmar()
+                    self.gerar_indices(pasta_saida, manifesto)
 
             if self.cancelado.value:
                 erros.append("Processamento cancelado pelo usuário")
                 logger.info("Processamento cancelado pelo usuário")
             else:
                 logger.info(f"Separação concluída: {pasta_saida}")
-            self.gerar_relatorio(pasta_saida, erros, imagens_sem_rostos)
\ No newline at end of file
+            self.gerar_relatorio(pasta_saida, erros, imagens_sem_rostos)
+            if Configuracao.PERFIL_EXECUCAO:
+                self.gerar_perfil(pasta_saida)
\ No newline at end of file
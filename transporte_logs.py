@@ -0,0 +1,105 @@
+import os
+import time
+import threading
+import logging
+import multiprocessing
+from multiprocessing import util
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ManipuladorLogsEmLote(logging.Handler):
+    """Envia os logs de cada processo para a interface em lotes, com limite de vazão.
+
+    Em vez de um registro por mensagem, cada processo junta as linhas já formatadas e as
+    envia como uma única lista a cada `intervalo` segundos ou quando o lote enche. Acima de
+    `limite_por_segundo`, as mensagens INFO e DEBUG são descartadas e substituídas por uma
+    linha com a quantidade omitida; avisos e erros sempre passam e são enviados na hora,
+    junto com o que já estava no lote.
+    """
+
+    def __init__(self, fila: 'multiprocessing.Queue', intervalo: float = 0.25, linhas_por_lote: int = 100, limite_por_segundo: int = 50):
+        super().__init__()
+        self.fila = fila
+        self.intervalo = intervalo
+        self.linhas_por_lote = linhas_por_lote
+        self.limite_por_segundo = limite_por_segundo
+        self._iniciar_estado()
+
+    def _iniciar_estado(self) -> None:
+        # Chamado de novo em cada processo filho: o fork não leva a thread de envio junto
+        self.pid = os.getpid()
+        self.linhas: List[str] = []
+        self.omitidas = 0
+        self.inicio_janela = time.monotonic()
+        self.na_janela = 0
+        self.trava_lote = threading.Lock()
+        self.parar = threading.Event()
+        self.thread_envio: Optional[threading.Thread] = None
+        # Envia o que restou quando o processo encerra normalmente (workers e estágios)
+        util.Finalize(self, self.flush, exitpriority=10)
+
+    def _garantir_envio(self) -> None:
+        if self.pid != os.getpid():
+            self._iniciar_estado()
+        if self.thread_envio is None:
+            self.thread_envio = threading.Thread(target=self._enviar_periodicamente, daemon=True)
+            self.thread_envio.start()
+
+    def _enviar_periodicamente(self) -> None:
+        while not self.parar.wait(self.intervalo):
+            self.flush()
+
+    def _aceitar(self, registro: logging.LogRecord) -> bool:
+        if registro.levelno >= logging.WARNING:
+            return True
+        agora = time.monotonic()
+        if agora - self.inicio_janela >= 1.0:
+            self.inicio_janela = agora
+            self.na_janela = 0
+        self.na_janela += 1
+        return self.na_janela <= self.limite_por_segundo
+
+    def emit(self, registro: logging.LogRecord) -> None:
+        try:
+            self._garantir_envio()
+            texto = self.format(registro)
+            with self.trava_lote:
+                if not self._aceitar(registro):
+                    self.omitidas += 1
+                    return
+                self.linhas.append(texto)
+                cheio = len(self.linhas) >= self.linhas_por_lote or registro.levelno >= logging.WARNING
+            if cheio:
+                self.flush()
+        except Exception:
+            self.handleError(registro)
+
+    def flush(self) -> None:
+        if self.pid != os.getpid():
+            self._iniciar_estado()
+        with self.trava_lote:
+            lote, self.linhas = self.linhas, []
+            if self.omitidas:
+                lote.append(f"... {self.omitidas} mensagens omitidas (processo {self.pid})")
+                self.omitidas = 0
+        if lote:
+            try:
+                self.fila.put(lote)
+            except (OSError, ValueError):
+                pass  # Fila já fechada no encerramento
+
+    def close(self) -> None:
+        self.parar.set()
+        self.flush()
+        super().close()
+
+
+# Converte um item da fila de logs (texto, lista de linhas ou LogRecord) em linhas de texto
+def linhas_do_item(item) -> List[str]:
+    if isinstance(item, list):
+        return [str(linha) for linha in item]
+    if isinstance(item, logging.LogRecord):
+        return [item.getMessage()]
+    return [str(item)]
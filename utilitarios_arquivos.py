@@ -1,13 +1,16 @@
 import os
+import sys
+import errno
 import shutil
 import json
+import hashlib
 import unicodedata
 import numpy as np
 from pathlib import Path
 from contextlib import contextmanager
 import tempfile
 import logging
-from typing import Dict, List, Iterator, Optional
+from typing import Callable, Dict, List, Iterator, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -32,13 +35,63 @@ def diretorio_temporario() -> Iterator[Path]:
     finally:
         shutil.rmtree(diretorio_temp, ignore_errors=True)
 
+EXTENSOES_IMAGEM = ('.jpg', '.jpeg', '.png')
+# Bytes iniciais de cada formato aceito
+ASSINATURAS_IMAGEM = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n')
+
+def cabecalho_imagem_valido(caminho: str) -> bool:
+    """Confere só os primeiros bytes do arquivo; a validação real acontece ao decodificar."""
+    try:
+        with open(caminho, 'rb') as f:
+            inicio = f.read(8)
+    except OSError:
+        return False
+    return inicio.startswith(ASSINATURAS_IMAGEM)
+
+def varrer_imagens(pasta: Path, validar_conteudo: bool = False) -> Iterator[Path]:
+    """Percorre a pasta e subpastas com os.scandir, checando extensão, tamanho e cabeçalho.
+
+    Com `validar_conteudo` cada arquivo é conferido por inteiro com o PIL (validar_imagem), em vez de só o cabeçalho.
+    """
+    from processamento_imagem import validar_imagem
+    pendentes = [str(pasta)]
+    while pendentes:
+        atual = pendentes.pop()
+        try:
+            with os.scandir(atual) as entradas:
+                for entrada in entradas:
+                    try:
+                        if entrada.is_dir(follow_symlinks=False):
+                            pendentes.append(entrada.path)
+                        elif entrada.name.lower().endswith(EXTENSOES_IMAGEM):
+                            if validar_conteudo:
+                                valida = validar_imagem(Path(entrada.path))
+                            else:
+                                valida = entrada.stat().st_size > 0 and cabecalho_imagem_valido(entrada.path)
+                            if valida:
+                                yield Path(entrada.path)
+                            else:
+                                logger.warning(f"Ignorando arquivo inválido: {entrada.path}")
+                    except OSError as e:
+                        logger.warning(f"Ignorando {entrada.path}: {e}")
+        except (PermissionError, OSError) as e:
+            logger.error(f"Erro ao listar imagens em {atual}: {e}")
+
 def listar_imagens(pasta: Path) -> List[Path]:
-    """Lista todas as imagens válidas em uma pasta e subpastas."""
+    """Lista todas as imagens válidas em uma pasta e subpastas.
+
+    Com LISTAGEM_RAPIDA apenas o cabeçalho de cada arquivo é conferido.
+    """
+    from processamento_imagem import Configuracao
+    if Configuracao.LISTAGEM_RAPIDA:
+        imagens = sorted(varrer_imagens(pasta))
+        logger.info(f"Encontradas {len(imagens)} imagens em {pasta}")
+        return imagens
     imagens = []
     try:
         for raiz, _, arquivos in os.walk(pasta):
             for arquivo in arquivos:
-                if arquivo.lower().endswith(('.jpg', '.jpeg', '.png')):
+                if arquivo.lower().endswith(EXTENSOES_IMAGEM):
                     caminho = Path(raiz) / arquivo
                     from processamento_imagem import validar_imagem
                     if validar_imagem(caminho):
@@ -51,40 +104,250 @@ def listar_imagens(pasta: Path) -> List[Path]:
         logger.error(f"Erro ao listar imagens em {pasta}: {e}")
         return []
 
-def carregar_rostos_conhecidos(pasta_referencia: Path, arquivo_json: Path, diretorio_temp: Path) -> Dict[str, List[np.ndarray]]:
-    """Carrega codificações de rostos conhecidos do arquivo JSON."""
-    from processamento_imagem import pre_processar_imagem, carregar_codificacoes_rostos
+# Formas de colocar uma foto na pasta de uma pessoa; "indice" só registra a foto em ARQUIVO_INDICE
+MODOS_COLOCACAO = ("copia", "hardlink", "reflink", "symlink", "indice")
+ARQUIVO_INDICE = "fotos.txt"
+FICLONE = 0x40049409  # ioctl de cópia por referência (Btrfs, XFS) no Linux
+_modos_indisponiveis = set()  # Modos que falharam nesta execução; herdado pelos workers criados depois
+
+def reiniciar_modos_colocacao() -> None:
+    """Volta a tentar todos os modos, para uma falha passageira não valer para as execuções seguintes."""
+    _modos_indisponiveis.clear()
+
+def _clonar_arquivo(origem: Path, destino: Path) -> None:
+    if not sys.platform.startswith('linux'):
+        raise OSError(f"Cópia por referência não suportada em {sys.platform}")
+    import fcntl
+    with origem.open('rb') as arquivo_origem, destino.open('wb') as arquivo_destino:
+        try:
+            fcntl.ioctl(arquivo_destino.fileno(), FICLONE, arquivo_origem.fileno())
+        except OSError:
+            arquivo_destino.close()
+            destino.unlink(missing_ok=True)
+            raise
+
+def colocar_arquivo(origem: Path, pasta_destino: Path, modo: str, nome: Optional[str] = None) -> str:
+    """Coloca o arquivo na pasta, com o nome indicado, pelo modo pedido e retorna o modo efetivamente usado.
+
+    Quando o sistema de arquivos não suporta o modo (outro volume, sem permissão para links,
+    sem cópia por referência), volta para a cópia comum.
+    """
+    destino = pasta_destino / (nome or origem.name)
+    # Um link deixado por execução anterior não pode ser sobrescrito: a cópia escreveria no original
+    if destino.is_symlink() or (destino.exists() and os.path.samefile(origem, destino)):
+        destino.unlink()
+    if modo in ("hardlink", "reflink", "symlink") and modo not in _modos_indisponiveis:
+        try:
+            if destino.exists():
+                destino.unlink()
+            if modo == "hardlink":
+                os.link(origem, destino)
+            elif modo == "symlink":
+                os.symlink(origem.resolve(), destino)
+            else:
+                _clonar_arquivo(origem, destino)
+            return modo
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                logger.debug(f"{modo} entre volumes diferentes para {origem}; copiando")
+            else:
+                # Falhas que não dependem do arquivo se repetiriam em todos: desiste do modo nesta execução
+                _modos_indisponiveis.add(modo)
+                logger.warning(f"Modo de colocação '{modo}' indisponível ({e}); usando cópia")
+    shutil.copy(origem, destino)
+    return "copia"
+
+def identificador_foto(caminho: Path) -> str:
+    """Identificador curto e estável de uma foto de entrada, derivado do caminho completo."""
+    return hashlib.blake2b(str(caminho).encode('utf-8', 'surrogatepass'), digest_size=6).hexdigest()
+
+class RegistroNomesSaida:
+    """Atribui a cada foto de entrada um nome de arquivo único nas pastas de saída.
+
+    Fotos com o mesmo nome em subpastas diferentes iriam para o mesmo arquivo de destino:
+    a primeira a ser vista fica com o nome original e as seguintes recebem o identificador
+    do caminho antes da extensão. Os nomes já gravados no manifesto são mantidos, para que
+    uma nova execução não renomeie o que já está nas pastas.
+    """
+
+    def __init__(self, existentes: Optional[Dict[str, str]] = None):
+        self.nomes: Dict[str, str] = {}  # caminho -> nome de saída
+        self.donos: Dict[str, str] = {}  # nome em minúsculas -> caminho
+        for caminho, nome in (existentes or {}).items():
+            self.nomes[caminho] = nome
+            self.donos.setdefault(nome.lower(), caminho)
+
+    def nome_saida(self, caminho: Path) -> str:
+        chave = str(caminho)
+        nome = self.nomes.get(chave)
+        if nome is None:
+            nome = caminho.name
+            if self.donos.setdefault(nome.lower(), chave) != chave:
+                nome = f"{caminho.stem}_{identificador_foto(caminho)}{caminho.suffix}"
+                self.donos[nome.lower()] = chave
+            self.nomes[chave] = nome
+        return nome
+
+def calcular_hash_conteudo(conteudo: bytes) -> str:
+    """Calcula o hash BLAKE2b de um conteúdo já lido em memória."""
+    return hashlib.blake2b(conteudo, digest_size=16).hexdigest()
+
+def calcular_hash_arquivo(caminho: Path, tamanho_bloco: int = 1 << 20) -> str:
+    """Calcula o hash BLAKE2b do conteúdo de um arquivo."""
+    resumo = hashlib.blake2b(digest_size=16)
+    with caminho.open('rb') as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+            resumo.update(bloco)
+    return resumo.hexdigest()
+
+def caminho_cache_codificacoes(arquivo_json: Path) -> Path:
+    """Retorna o caminho do cache binário de codificações ao lado do JSON."""
+    return arquivo_json.with_suffix('.npz')
+
+def carregar_cache_codificacoes(arquivo_cache: Path) -> Dict[str, dict]:
+    """Lê o cache de codificações; descarta o cache inteiro se foi gerado com outro modelo ou detector."""
+    from processamento_imagem import Configuracao, identificador_detector
+    entradas = {}
+    if not arquivo_cache.exists():
+        return entradas
+    try:
+        with np.load(arquivo_cache, allow_pickle=False) as dados:
+            if str(dados['modelo']) != Configuracao.MODELO or str(dados['detector']) != identificador_detector():
+                logger.info(f"Cache {arquivo_cache} gerado com outro modelo/detector; será recalculado")
+                return entradas
+            codificacoes = dados['codificacoes']
+            inicios = dados['inicios']
+            for i, caminho in enumerate(dados['caminhos']):
+                entradas[str(caminho)] = {
+                    'tamanho': int(dados['tamanhos'][i]),
+                    'mtime': int(dados['mtimes'][i]),
+                    'hash': str(dados['hashes'][i]),
+                    'codificacoes': [codificacoes[j] for j in range(inicios[i], inicios[i + 1])],
+                }
+        logger.info(f"Cache de codificações carregado: {len(entradas)} imagens")
+    except (KeyError, ValueError, OSError) as e:
+        logger.warning(f"Cache de codificações inválido em {arquivo_cache}, ignorando: {e}")
+        entradas = {}
+    return entradas
+
+def salvar_cache_codificacoes(arquivo_cache: Path, entradas: Dict[str, dict]) -> None:
+    """Grava o cache de codificações (float32) de forma atômica."""
+    from processamento_imagem import Configuracao, identificador_detector
+    caminhos = sorted(entradas)
+    inicios = [0]
+    codificacoes = []
+    for caminho in caminhos:
+        codificacoes.extend(entradas[caminho]['codificacoes'])
+        inicios.append(len(codificacoes))
+    matriz = np.asarray(codificacoes, dtype=np.float32) if codificacoes else np.zeros((0, 0), dtype=np.float32)
+    arquivo_temp = arquivo_cache.with_name(arquivo_cache.name + '.tmp')
+    try:
+        arquivo_cache.parent.mkdir(parents=True, exist_ok=True)
+        with arquivo_temp.open('wb') as f:
+            np.savez(
+                f,
+                modelo=np.array(Configuracao.MODELO),
+                detector=np.array(identificador_detector()),
+                caminhos=np.array(caminhos, dtype=str),
+                tamanhos=np.array([entradas[c]['tamanho'] for c in caminhos], dtype=np.int64),
+                mtimes=np.array([entradas[c]['mtime'] for c in caminhos], dtype=np.int64),
+                hashes=np.array([entradas[c]['hash'] for c in caminhos], dtype=str),
+                inicios=np.array(inicios, dtype=np.int64),
+                codificacoes=matriz,
+            )
+        os.replace(arquivo_temp, arquivo_cache)
+        logger.info(f"Cache de codificações salvo em {arquivo_cache} ({len(caminhos)} imagens)")
+    except (PermissionError, OSError) as e:
+        logger.error(f"Erro ao salvar cache {arquivo_cache}: {e}")
+        arquivo_temp.unlink(missing_ok=True)
+
+def criar_entrada_cache(caminho: Path, codificacoes: List[np.ndarray]) -> dict:
+    """Monta a entrada de cache de uma imagem a partir do seu estado atual em disco."""
+    estado = caminho.stat()
+    return {
+        'tamanho': estado.st_size,
+        'mtime': estado.st_mtime_ns,
+        'hash': calcular_hash_arquivo(caminho),
+        'codificacoes': [np.asarray(c, dtype=np.float32) for c in codificacoes],
+    }
+
+def obter_entrada_cache(entrada: Optional[dict], caminho: Path) -> Optional[dict]:
+    """Retorna a entrada se ainda corresponde ao arquivo (tamanho+mtime, ou hash quando só o mtime mudou)."""
+    if entrada is None:
+        return None
+    estado = caminho.stat()
+    if entrada['tamanho'] != estado.st_size:
+        return None
+    if entrada['mtime'] == estado.st_mtime_ns:
+        return entrada
+    if calcular_hash_arquivo(caminho) == entrada['hash']:
+        return dict(entrada, mtime=estado.st_mtime_ns)
+    return None
+
+def carregar_rostos_conhecidos(pasta_referencia: Path, arquivo_json: Path, diretorio_temp: Path, codificar: Optional[Callable[[List[Path]], List[Optional[List[np.ndarray]]]]] = None) -> Dict[str, List[np.ndarray]]:
+    """Carrega codificações de rostos conhecidos do arquivo JSON, reaproveitando o cache binário.
+
+    As imagens fora do cache são recalculadas juntas por `codificar` (uma lista de caminhos,
+    um resultado por caminho); sem ele, uma a uma neste processo.
+    """
+    if codificar is None:
+        from processamento_imagem import codificar_imagem
+
+        def codificar(caminhos: List[Path]) -> List[Optional[List[np.ndarray]]]:
+            return [codificar_imagem(caminho, diretorio_temp / f"ref_{caminho.name}") for caminho in caminhos]
     rostos = {}
     if not arquivo_json.exists():
         return rostos
+    arquivo_cache = caminho_cache_codificacoes(arquivo_json)
+    cache = carregar_cache_codificacoes(arquivo_cache)
+    novo_cache = {}
     try:
         with arquivo_json.open('r', encoding='utf-8') as f:
             dados = json.load(f)
+        imagens_por_nome = {}
+        faltantes = {}  # chave -> caminho das imagens sem entrada válida no cache
         for nome, info in dados.items():
-            codificacoes = []
+            imagens_por_nome[nome] = []
             for caminho in info['imagens']:
                 caminho = Path(normalizar_caminho(caminho, str(pasta_referencia)))
                 if not caminho.exists():
                     continue
-                caminho_temp = diretorio_temp / f"ref_{caminho.name}"
-                if pre_processar_imagem(caminho, caminho_temp):
-                    codificacoes.extend(carregar_codificacoes_rostos(caminho_temp))
+                chave = normalizar_caminho(caminho)  # Mesma forma de chave usada em salvar_rostos_conhecidos
+                imagens_por_nome[nome].append(chave)
+                entrada = obter_entrada_cache(cache.get(chave), caminho)
+                if entrada is None:
+                    faltantes[chave] = caminho
+                else:
+                    novo_cache[chave] = entrada
+        if faltantes:
+            for (chave, caminho), codificacoes_imagem in zip(faltantes.items(), codificar(list(faltantes.values()))):
+                novo_cache[chave] = criar_entrada_cache(caminho, codificacoes_imagem or [])
+        for nome, chaves in imagens_por_nome.items():
+            codificacoes = [c for chave in chaves for c in novo_cache[chave]['codificacoes']]
             if codificacoes:
                 rostos[nome] = codificacoes
             else:
                 logger.warning(f"Nenhuma codificação válida para {nome}")
-        logger.info("Rostos conhecidos carregados com sucesso")
+        logger.info(f"Rostos conhecidos carregados com sucesso ({len(faltantes)} imagens recalculadas)")
+        if faltantes or novo_cache.keys() != cache.keys() or any(novo_cache[c] is not cache[c] for c in novo_cache):
+            salvar_cache_codificacoes(arquivo_cache, novo_cache)
     except (json.JSONDecodeError, PermissionError, OSError) as e:
         logger.error(f"Erro ao carregar {arquivo_json}: {e}")
     return rostos
 
-def salvar_rostos_conhecidos(rostos: Dict[str, List[np.ndarray]], pasta_referencia: Path, arquivo_json: Path, imagens: Dict[str, List[Path]]) -> None:
-    """Salva codificações de rostos conhecidos no arquivo JSON."""
+def salvar_rostos_conhecidos(rostos: Dict[str, List[np.ndarray]], pasta_referencia: Path, arquivo_json: Path, imagens: Dict[str, List[Path]], codificacoes_por_imagem: Optional[Dict[Path, List[np.ndarray]]] = None) -> None:
+    """Salva as imagens de referência no arquivo JSON e suas codificações no cache binário."""
     try:
         dados = {nome: {"imagens": [str(img) for img in imagens.get(nome, [])]} for nome in rostos}
         arquivo_json.parent.mkdir(parents=True, exist_ok=True)  # Garante que a pasta de saída existe
         with arquivo_json.open('w', encoding='utf-8') as f:
             json.dump(dados, f, indent=2)
         logger.info(f"Rostos conhecidos salvos em {arquivo_json}")
+        if codificacoes_por_imagem:
+            entradas = {
+                normalizar_caminho(caminho): criar_entrada_cache(Path(caminho), codificacoes)
+                for caminho, codificacoes in codificacoes_por_imagem.items()
+            }
+            salvar_cache_codificacoes(caminho_cache_codificacoes(arquivo_json), entradas)
     except (PermissionError, OSError) as e:
-        logger.error(f"Erro ao salvar {arquivo_json}: {e}")
\ No newline at end of file
+        logger.error(f"Erro ao salvar {arquivo_json}: {e}")